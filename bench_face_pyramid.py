@@ -0,0 +1,96 @@
+import argparse
+import glob
+import importlib.util
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+# Benchmarks the reduced-resolution face detection pyramid used by the face crop
+# nodes: detection latency per long-side target (with and without refinement) and
+# IoU of the largest face against full-resolution detection on the same image.
+#
+#   python bench_face_pyramid.py --images path/to/images --backend mediapipe
+#   python bench_face_pyramid.py --images path/to/images --backend deepface:retinaface
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--images", required=True, help="Directory with the fixed image set")
+parser.add_argument("--backend", default="mediapipe", help="'mediapipe' or 'deepface:<detector_backend>'")
+parser.add_argument("--model", default="nodes/blaze_face_short_range.tflite", help="MediaPipe .tflite model")
+parser.add_argument("--sizes", default="320,512,768,1024", help="Comma-separated detect_long_side targets")
+parser.add_argument("--repeats", type=int, default=3)
+args = parser.parse_args()
+
+# Load nodes/face_utils.py directly; importing the nodes package needs ComfyUI
+spec = importlib.util.spec_from_file_location(
+    "face_utils", os.path.join(os.path.dirname(os.path.abspath(__file__)), "nodes", "face_utils.py")
+)
+face_utils = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(face_utils)
+
+paths = sorted(p for ext in ("png", "jpg", "jpeg", "webp") for p in glob.glob(os.path.join(args.images, f"*.{ext}")))
+images = [np.array(Image.open(p).convert("RGB")) for p in paths]
+print(f"Loaded {len(images)} image(s) from {args.images}")
+
+if args.backend == "mediapipe":
+    import mediapipe as mp
+    from mediapipe.tasks.python import BaseOptions
+    from mediapipe.tasks.python.vision import FaceDetector, FaceDetectorOptions, RunningMode
+
+    detector = FaceDetector.create_from_options(
+        FaceDetectorOptions(base_options=BaseOptions(model_asset_path=args.model), running_mode=RunningMode.IMAGE)
+    )
+
+    def detect(img):
+        result = detector.detect(mp.Image(image_format=mp.ImageFormat.SRGB, data=np.ascontiguousarray(img)))
+        return [
+            (d.bounding_box.origin_x, d.bounding_box.origin_y, d.bounding_box.width, d.bounding_box.height,
+             d.categories[0].score if d.categories else 1.0)
+            for d in result.detections
+        ]
+else:
+    from deepface import DeepFace
+
+    detector_backend = args.backend.split(":", 1)[1] if ":" in args.backend else "retinaface"
+
+    def detect(img):
+        return [
+            (d["facial_area"]["x"], d["facial_area"]["y"], d["facial_area"]["w"], d["facial_area"]["h"],
+             d.get("confidence", 0.0))
+            for d in DeepFace.extract_faces(img_path=img, detector_backend=detector_backend, enforce_detection=False, align=False)
+        ]
+
+
+def run(img, long_side, refine):
+    """Returns (largest box or None, seconds)."""
+    t0 = time.perf_counter()
+    boxes = face_utils.detect_pyramid(img, detect, long_side, refine)
+    elapsed = time.perf_counter() - t0
+    return (max(boxes, key=lambda b: b[2] * b[3]) if boxes else None), elapsed
+
+
+def iou(a, b):
+    if a is None or b is None:
+        return float(a is None and b is None)
+    return face_utils.box_iou(a, b)
+
+
+run(images[0], 0, False)  # warm-up
+
+modes = [(0, False)] + [(int(s), refine) for s in args.sizes.split(",") for refine in (False, True)]
+reference = {}
+print(f"{'long side':<12}{'refine':>8}{'ms':>10}{'IoU vs full':>14}{'found':>8}")
+for long_side, refine in modes:
+    times, ious, found = [], [], 0
+    for i, img in enumerate(images):
+        for _ in range(args.repeats):
+            box, elapsed = run(img, long_side, refine)
+            times.append(elapsed)
+        if long_side == 0:
+            reference[i] = box
+        ious.append(iou(reference[i], box))
+        found += box is not None
+
+    label = "full" if long_side == 0 else str(long_side)
+    print(f"{label:<12}{'yes' if refine else 'no':>8}{1000 * np.mean(times):>10.1f}{np.mean(ious):>14.4f}{found:>8}")
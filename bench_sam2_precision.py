@@ -0,0 +1,114 @@
+import argparse
+import contextlib
+import glob
+import os
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+from transformers import AutoProcessor, AutoModelForZeroShotObjectDetection
+from sam2.build_sam import build_sam2
+from sam2.sam2_image_predictor import SAM2ImagePredictor
+
+# Benchmarks GroundingDINO + SAM2 latency per device/precision mode and compares the
+# resulting masks against the fp32 run on the same device (mask IoU).
+#
+#   python bench_sam2_precision.py --images path/to/images --prompt "face." \
+#       --dino models/grounding-dino/grounding-dino-base \
+#       --sam models/sams/sam2_hiera_large.pt --sam-config sam2_hiera_l.yaml
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--images", required=True, help="Directory with the fixed image set")
+parser.add_argument("--prompt", default="face.")
+parser.add_argument("--dino", default=r"models/grounding-dino/grounding-dino-base")
+parser.add_argument("--sam", default=r"models/sams/sam2_hiera_large.pt")
+parser.add_argument("--sam-config", default="sam2_hiera_l.yaml")
+parser.add_argument("--box-threshold", type=float, default=0.3)
+parser.add_argument("--cpu-threads", type=int, default=0)
+parser.add_argument("--repeats", type=int, default=3)
+args = parser.parse_args()
+
+if args.cpu_threads > 0:
+    torch.set_num_threads(args.cpu_threads)
+
+paths = sorted(p for ext in ("png", "jpg", "jpeg", "webp") for p in glob.glob(os.path.join(args.images, f"*.{ext}")))
+images = [np.array(Image.open(p).convert("RGB")) for p in paths]
+print(f"Loaded {len(images)} image(s) from {args.images}")
+
+modes = [("cpu", "fp32"), ("cpu", "bf16")]
+if torch.cuda.is_available():
+    modes += [("cuda", "fp32"), ("cuda", "fp16")]
+    if torch.cuda.is_bf16_supported():
+        modes.append(("cuda", "bf16"))
+dtypes = {"fp16": torch.float16, "bf16": torch.bfloat16}
+
+processor = AutoProcessor.from_pretrained(args.dino, local_files_only=True, use_fast=False)
+dino_model = AutoModelForZeroShotObjectDetection.from_pretrained(args.dino, local_files_only=True).eval()
+predictor = SAM2ImagePredictor(build_sam2(args.sam_config, args.sam, device="cpu"))
+
+
+def autocast(device, precision):
+    if precision == "fp32":
+        return contextlib.nullcontext()
+    return torch.autocast(device_type=device, dtype=dtypes[precision])
+
+
+def sync(device):
+    if device == "cuda":
+        torch.cuda.synchronize()
+
+
+def run(img, device, precision):
+    """Returns (best box or None, mask or None, dino seconds, sam seconds)."""
+    pil = Image.fromarray(img)
+    sync(device)
+    t0 = time.perf_counter()
+    inputs = processor(images=pil, text=args.prompt, return_tensors="pt").to(device)
+    with torch.no_grad(), autocast(device, precision):
+        outputs = dino_model(**inputs)
+    outputs.logits = outputs.logits.float()
+    outputs.pred_boxes = outputs.pred_boxes.float()
+    result = processor.post_process_grounded_object_detection(outputs, inputs.input_ids, target_sizes=[pil.size[::-1]])[0]
+    sync(device)
+    t1 = time.perf_counter()
+
+    keep = result["scores"] > args.box_threshold
+    if not keep.any():
+        return None, None, t1 - t0, 0.0
+    box = result["boxes"][keep][result["scores"][keep].argmax()].cpu().numpy()
+
+    with torch.no_grad(), autocast(device, precision):
+        predictor.set_image(img)
+        masks, _, _ = predictor.predict(box=box, multimask_output=False)
+    sync(device)
+    t2 = time.perf_counter()
+    return box, masks[0] > 0.0, t1 - t0, t2 - t1
+
+
+def iou(a, b):
+    if a is None or b is None:
+        return float(a is None and b is None)
+    union = np.logical_or(a, b).sum()
+    return float(np.logical_and(a, b).sum() / union) if union else 1.0
+
+
+reference = {}
+print(f"{'mode':<12}{'dino ms':>10}{'sam2 ms':>10}{'total ms':>10}{'IoU vs fp32':>14}")
+for device, precision in modes:
+    dino_model.to(device)
+    predictor.model.to(device)
+    run(images[0], device, precision)  # warm-up
+
+    dino_times, sam_times, ious = [], [], []
+    for i, img in enumerate(images):
+        for _ in range(args.repeats):
+            _, mask, t_dino, t_sam = run(img, device, precision)
+            dino_times.append(t_dino)
+            sam_times.append(t_sam)
+        if precision == "fp32":
+            reference[(device, i)] = mask
+        ious.append(iou(reference[(device, i)], mask))
+
+    dino_ms, sam_ms = 1000 * np.mean(dino_times), 1000 * np.mean(sam_times)
+    print(f"{device + '/' + precision:<12}{dino_ms:>10.1f}{sam_ms:>10.1f}{dino_ms + sam_ms:>10.1f}{np.mean(ious):>14.4f}")
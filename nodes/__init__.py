@@ -32,6 +32,10 @@ from .deepface_node import (
     NODE_CLASS_MAPPINGS as _df_crop_cls,
     NODE_DISPLAY_NAME_MAPPINGS as _df_crop_name,
 )
+from .face_gallery import (
+    NODE_CLASS_MAPPINGS as _gallery_cls,
+    NODE_DISPLAY_NAME_MAPPINGS as _gallery_name,
+)
 from .qwen2_5_vl import (
     NODE_CLASS_MAPPINGS as _qwen_cls,
     NODE_DISPLAY_NAME_MAPPINGS as _qwen_name,
@@ -69,6 +73,7 @@ NODE_CLASS_MAPPINGS = {
 
     **_mp_crop_cls,
     **_df_crop_cls,
+    **_gallery_cls,
     **_qwen_cls,
     **_z_prompt_cls,
     "MidnightLook_PresetPrompt": MidnightLook_PresetPrompt,
@@ -89,6 +94,7 @@ NODE_DISPLAY_NAME_MAPPINGS = {
 
     **_mp_crop_name,
     **_df_crop_name,
+    **_gallery_name,
     **_qwen_name,
     **_z_prompt_name,
     "MidnightLook_PresetPrompt": "Preset Prompt (ML)",
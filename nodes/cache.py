@@ -0,0 +1,131 @@
+"""
+In-process Caches
+=================
+Small bounded LRU cache shared by MidnightLook nodes for results that are
+expensive to recompute but cheap to keep (conditionings, embeddings, ...).
+
+Entries are evicted least-recently-used first once either ``max_entries`` or
+``max_bytes`` (measured with ``size_fn``) is exceeded. Hit/miss counters are
+kept so nodes can report how effective a cache is.
+
+``image_hash`` gives a content key for image arrays so results can be shared
+between calls that see the same pixels.
+
+Dependencies: numpy
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def image_hash(array):
+    """Content hash of an image array (numpy or CPU torch tensor), including shape and dtype."""
+    if hasattr(array, "detach"):
+        array = array.detach().cpu().numpy()
+    array = np.ascontiguousarray(array)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{array.shape}|{array.dtype}".encode("utf-8"))
+    digest.update(memoryview(array).cast("B"))
+    return digest.hexdigest()
+
+
+def tensor_nbytes(value):
+    """Total bytes of all tensors/arrays found in a (nested) dict/list/tuple value."""
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    if isinstance(value, dict):
+        return sum(tensor_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(tensor_nbytes(v) for v in value)
+    return 0
+
+
+class LRUCache:
+    """Thread-safe LRU mapping with an entry limit, an optional byte budget and hit/miss stats."""
+
+    def __init__(self, name, max_entries=None, max_bytes=None, size_fn=None):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size_fn = size_fn
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._bytes = 0
+        self._data = OrderedDict()  # key -> (value, size)
+        self._lock = threading.RLock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key][0]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        size = self.size_fn(value) if self.size_fn is not None else 0
+        with self._lock:
+            if key in self._data:
+                self._bytes -= self._data.pop(key)[1]
+            # An entry larger than the whole budget is never stored
+            if self.max_bytes is not None and size > self.max_bytes:
+                return value
+            self._data[key] = (value, size)
+            self._bytes += size
+            self._evict()
+        return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            value, size = self._data.pop(key)
+            self._bytes -= size
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def _evict(self):
+        while self._data and (
+            (self.max_entries is not None and len(self._data) > self.max_entries)
+            or (self.max_bytes is not None and self._bytes > self.max_bytes)
+        ):
+            _, (_, size) = self._data.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "name": self.name,
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
+
+    def stats_line(self):
+        s = self.stats()
+        return (
+            f"{s['name']}: {s['hits']} hit(s), {s['misses']} miss(es), "
+            f"{s['entries']} entr{'y' if s['entries'] == 1 else 'ies'}"
+        )
@@ -4,13 +4,29 @@ DeepFace Node for ComfyUI
 Wrapper around the ``deepface`` library to provide robust face detection
 using state-of-the-art backends (RetinaFace, YOLOv8, etc.).
 
+DeepFace builds its detector / recognition models lazily inside the first
+call of each process. ``MIDNIGHTLOOK_DEEPFACE_WARMUP`` (comma-separated
+detector backends and recognition model names, e.g. ``"ssd,Facenet512"``)
+builds them in a background thread when the node is loaded; the
+``DeepFace_WarmUp`` node does the same on demand. Built models stay
+resident in DeepFace's model cache for the life of the process.
+
 Dependencies: deepface, numpy, torch, Pillow
 """
 
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import torch
 from PIL import Image
 
+from .cache import LRUCache, image_hash
+from .detection_cache import detection_cache, detection_key, stats_line
+from .face_utils import crop_bboxes, detect_pyramid, letterbox_crops, padded_crop_box, stack_crops
+
 # Lazy import to prevent startup crashes if deepface is missing
 try:
     from deepface import DeepFace
@@ -19,102 +35,429 @@ except ImportError:
     DEEPFACE_AVAILABLE = False
 
 
+def _extract_boxes(img_np, detector_backend, align):
+    """``(x, y, w, h, confidence)`` of every face DeepFace finds in ``img_np``."""
+    _wait_for_warmup()
+    detections = DeepFace.extract_faces(
+        img_path=img_np,
+        detector_backend=detector_backend,
+        enforce_detection=False,  # Don't crash if no face
+        align=align,
+        grayscale=False,
+    )
+    # DeepFace returns 'facial_area': {'x': int, 'y': int, 'w': int, 'h': int}
+    # and a 'confidence' key (0-1 approx, backend dependent)
+    return [
+        (
+            d["facial_area"]["x"],
+            d["facial_area"]["y"],
+            d["facial_area"]["w"],
+            d["facial_area"]["h"],
+            d.get("confidence", 0.0),
+        )
+        for d in detections
+    ]
+
+
+# ---------------------------------------------------------------------- #
+#  Batch detection
+# ---------------------------------------------------------------------- #
+# Backends whose DeepFace client holds one net / graph that can't run
+# concurrently (OpenCV setInput / forward, MediaPipe's legacy FaceDetection
+# graph). Before fanning out, their cached client is swapped for a
+# _DetectorClientPool so every concurrent worker runs its own instance;
+# where DeepFace's model cache isn't reachable their calls are serialised.
+_SHARED_NET_BACKENDS = {"ssd", "centerface", "yunet", "mediapipe"}
+_backend_locks = {name: threading.Lock() for name in _SHARED_NET_BACKENDS}
+_pooled_backends = set()
+
+
+class _DetectorClientPool:
+    """
+    Stands in for DeepFace's cached detector client of one backend. Each
+    call borrows an idle client and builds a new one when all are busy, so
+    concurrent workers never share a net; clients are kept for later
+    batches, so the pool grows to the largest number of workers used.
+    """
+
+    def __init__(self, client):
+        self._client_cls = type(client)
+        self._idle = [client]
+        self._lock = threading.Lock()
+
+    def detect_faces(self, img):
+        with self._lock:
+            client = self._idle.pop() if self._idle else None
+        if client is None:
+            client = self._client_cls()
+        try:
+            return client.detect_faces(img)
+        finally:
+            with self._lock:
+                self._idle.append(client)
+
+
+def _pool_detector_clients(detector_backend):
+    """Swaps DeepFace's cached client of ``detector_backend`` for a
+    ``_DetectorClientPool``. Returns False where DeepFace's model cache
+    isn't reachable (deepface < 0.0.90), so the backend stays locked."""
+    with _backend_locks[detector_backend]:
+        if detector_backend in _pooled_backends:
+            return True
+        try:
+            from deepface.modules import modeling
+            client = modeling.build_model(task="face_detector", model_name=detector_backend)
+            cache = modeling.cached_models["face_detector"]
+        except (ImportError, AttributeError, KeyError, TypeError):
+            return False
+        if not isinstance(client, _DetectorClientPool):
+            cache[detector_backend] = _DetectorClientPool(client)
+        _pooled_backends.add(detector_backend)
+        return True
+
+
+def _detect_job(job):
+    """Raw detections of one frame, or None if DeepFace failed."""
+    img_np, detector_backend, align, detect_long_side, refine_faces = job
+    lock = None if detector_backend in _pooled_backends else _backend_locks.get(detector_backend)
+    try:
+        if lock is None:
+            return tuple(detect_pyramid(
+                img_np, lambda x: _extract_boxes(x, detector_backend, align), detect_long_side, refine_faces
+            ))
+        with lock:
+            return tuple(detect_pyramid(
+                img_np, lambda x: _extract_boxes(x, detector_backend, align), detect_long_side, refine_faces
+            ))
+    except Exception as e:
+        print(f"⚠️ DeepFace error: {e}")
+        return None
+
+
+def _run_jobs(jobs, workers, detector_backend):
+    """Runs ``_detect_job`` over ``jobs`` on a thread pool, in order."""
+    if workers <= 1 or len(jobs) <= 1:
+        return [_detect_job(job) for job in jobs]
+
+    if detector_backend in _SHARED_NET_BACKENDS and not _pool_detector_clients(detector_backend):
+        print(f"⚠️ DeepFace_FaceCrop: This deepface version shares one {detector_backend} model; its frames run one at a time.")
+    with ThreadPoolExecutor(max_workers=min(workers, len(jobs)), thread_name_prefix="deepface-crop") as executor:
+        return list(executor.map(_detect_job, jobs))
+
+
+def _detect_faces_batch(imgs_np, detector_backend, align, detect_long_side=0, refine_faces=False, workers=1):
+    """Raw ``(x, y, w, h, confidence)`` detections of every frame of
+    ``imgs_np``. Frames seen before (by the crop node or the BBOX_DETECTOR)
+    are answered from the shared detection cache; the rest are fanned out
+    to ``workers`` threads and gathered in order."""
+    params = (detector_backend, align, detect_long_side, refine_faces)
+    keys = [detection_key("deepface", params, img_np) for img_np in imgs_np]
+    results = [detection_cache.get(key) for key in keys]
+
+    missing = [i for i, r in enumerate(results) if r is None]
+    if missing:
+        jobs = [(imgs_np[i],) + params for i in missing]
+        # The first frame runs here so the backend model is built once before fanning out
+        computed = [_detect_job(jobs[0])] + _run_jobs(jobs[1:], workers, detector_backend)
+        for i, detections in zip(missing, computed):
+            if detections is None:
+                # Failed frames count as "no face" but are not cached
+                print(f"⚠️ DeepFace ({detector_backend}): Detection failed on frame {i}; treating it as no face.")
+                results[i] = ()
+            else:
+                results[i] = detection_cache.put(keys[i], detections)
+    return results
+
+
+# ---------------------------------------------------------------------- #
+#  Warm-up
+# ---------------------------------------------------------------------- #
+# Used to tell recognition models from detector backends in the env var
+RECOGNITION_MODELS = [
+    "VGG-Face", "Facenet", "Facenet512", "OpenFace", "DeepFace",
+    "DeepID", "ArcFace", "Dlib", "SFace", "GhostFaceNet",
+]
+
+_warmup_lock = threading.Lock()
+_warmup_thread = None
+# ("detector" | "recognizer", name) -> {"build_s", "first_call_s"} or {"error"}
+_warmup_status = {}
+
+
+def _build_model(kind, name):
+    """Builds (and caches inside DeepFace) one detector or recognition model."""
+    task = "facial_recognition" if kind == "recognizer" else "face_detector"
+    try:
+        return DeepFace.build_model(task=task, model_name=name)
+    except TypeError:
+        # deepface < 0.0.90 only builds recognition models, by positional name;
+        # detectors there are built by their first call below
+        if kind == "recognizer":
+            return DeepFace.build_model(name)
+        return None
+
+
+def _first_call(kind, name):
+    """One real call through DeepFace on a blank frame (graph tracing, lazy init, ...)."""
+    blank = np.full((224, 224, 3), 127, dtype=np.uint8)
+    if kind == "recognizer":
+        DeepFace.represent(img_path=blank, model_name=name, detector_backend="skip", enforce_detection=False)
+    else:
+        DeepFace.extract_faces(img_path=blank, detector_backend=name, enforce_detection=False, align=False)
+
+
+def _warm_up_one(kind, name):
+    key = (kind, name)
+    with _warmup_lock:
+        status = _warmup_status.get(key)
+        if status is not None and "error" not in status:
+            return status
+
+        try:
+            t0 = time.perf_counter()
+            _build_model(kind, name)
+            t1 = time.perf_counter()
+            _first_call(kind, name)
+            t2 = time.perf_counter()
+            status = {"build_s": t1 - t0, "first_call_s": t2 - t1}
+            print(f"🔥 DeepFace warm-up: {kind} {name} built in {status['build_s']:.2f}s, first call {status['first_call_s']:.2f}s")
+        except Exception as e:
+            status = {"error": str(e)}
+            print(f"⚠️ DeepFace warm-up: {kind} {name} failed: {e}")
+        _warmup_status[key] = status
+        return status
+
+
+def _split_names(names):
+    return [n.strip() for n in names.split(",") if n.strip()]
+
+
+def warm_up(detector_backends=(), model_names=()):
+    """Builds the given detector backends and recognition models and returns
+    one report line per model. Already warm models are not rebuilt."""
+    if not DEEPFACE_AVAILABLE:
+        return ["DeepFace library not found."]
+
+    lines = []
+    pairs = [("detector", n) for n in detector_backends] + [("recognizer", n) for n in model_names]
+    for kind, name in pairs:
+        status = _warm_up_one(kind, name)
+        if "error" in status:
+            lines.append(f"⚠️ {kind} {name}: {status['error']}")
+        else:
+            lines.append(f"✅ {kind} {name}: build {status['build_s']:.2f}s | first call {status['first_call_s']:.2f}s")
+    return lines
+
+
+def _wait_for_warmup():
+    """Lets a first real call wait for the load-time warm-up instead of
+    building the same model concurrently."""
+    thread = _warmup_thread
+    if thread is not None and thread.is_alive():
+        thread.join()
+
+
+def _start_background_warmup():
+    global _warmup_thread
+    names = _split_names(os.environ.get("MIDNIGHTLOOK_DEEPFACE_WARMUP", ""))
+    if not names or not DEEPFACE_AVAILABLE:
+        return
+    detectors = [n for n in names if n not in RECOGNITION_MODELS]
+    recognizers = [n for n in names if n in RECOGNITION_MODELS]
+    _warmup_thread = threading.Thread(target=warm_up, args=(detectors, recognizers), name="deepface-warmup", daemon=True)
+    _warmup_thread.start()
+
+
+# ---------------------------------------------------------------------- #
+#  Embeddings
+# ---------------------------------------------------------------------- #
+# Reference embeddings keyed by (model, detector backend, image content)
+_reference_cache = LRUCache("deepface reference embeddings", max_entries=64)
+
+
+def _represent(img_np, model_name, detector_backend, largest_only=False):
+    """``[F, D]`` float32 embeddings of every face DeepFace finds in ``img_np``
+    (the whole frame when no face is found), or of the largest face only."""
+    _wait_for_warmup()
+    representations = DeepFace.represent(
+        img_path=img_np,
+        model_name=model_name,
+        detector_backend=detector_backend,
+        enforce_detection=False,
+        align=True,
+    )
+    if largest_only and representations:
+        representations = [max(
+            representations,
+            key=lambda r: r.get("facial_area", {}).get("w", 0) * r.get("facial_area", {}).get("h", 0),
+        )]
+    return np.asarray(
+        [r["embedding"] for r in representations], dtype=np.float32
+    ).reshape(len(representations), -1)
+
+
+def _reference_embeddings(img_np, model_name, detector_backend):
+    key = (model_name, detector_backend, image_hash(img_np))
+    embeddings = _reference_cache.get(key)
+    if embeddings is None:
+        embeddings = _reference_cache.put(key, _represent(img_np, model_name, detector_backend))
+    return embeddings
+
+
+def _pairwise_distances(a, b, distance_metric):
+    """``[A, B]`` distances between the rows of ``a`` and ``b``, with
+    DeepFace's cosine / euclidean / euclidean_l2 definitions."""
+    a = a.astype(np.float64)
+    b = b.astype(np.float64)
+    if distance_metric in ("cosine", "euclidean_l2"):
+        a = a / np.maximum(np.linalg.norm(a, axis=1, keepdims=True), 1e-12)
+        b = b / np.maximum(np.linalg.norm(b, axis=1, keepdims=True), 1e-12)
+    if distance_metric == "cosine":
+        return 1.0 - a @ b.T
+    # Direct differences: exact near 0 (A and B are face counts, so this stays small)
+    return np.linalg.norm(a[:, None, :] - b[None, :, :], axis=2)
+
+
+def _dilate_rects(rects, dilation, w, h):
+    """
+    Vectorized ``cv2.dilate`` / ``cv2.erode`` (square ``|dilation|`` kernel,
+    default anchor, one iteration, as Impact Pack's ``dilate_mask`` does) of
+    filled ``[N, 4]`` rectangles ``(x1, y1, x2, y2)`` (end exclusive), each
+    drawn on its own ``w`` x ``h`` mask (scalars or ``[N]`` arrays). Returns
+    the clamped result rectangles; empty ones end up with ``x2 <= x1`` or
+    ``y2 <= y1``.
+    """
+    rects = np.asarray(rects, dtype=np.int64).reshape(-1, 4).copy()
+    w = np.broadcast_to(np.asarray(w, dtype=np.int64), (len(rects),))
+    h = np.broadcast_to(np.asarray(h, dtype=np.int64), (len(rects),))
+    k = abs(int(dilation))
+    if k > 0:
+        before, after = k // 2, k - 1 - k // 2
+        x1, y1, x2, y2 = rects.T
+        if dilation > 0:
+            rects = np.stack([x1 - after, y1 - after, x2 + before, y2 + before], axis=1)
+        else:
+            # OpenCV erodes with a border of 1, so edges on the mask border stay put
+            rects = np.stack([
+                np.where(x1 > 0, x1 + before, x1),
+                np.where(y1 > 0, y1 + before, y1),
+                np.where(x2 < w, x2 - after, x2),
+                np.where(y2 < h, y2 - after, y2),
+            ], axis=1)
+    rects[:, [0, 2]] = rects[:, [0, 2]].clip(0, w[:, None])
+    rects[:, [1, 3]] = rects[:, [1, 3]].clip(0, h[:, None])
+    return rects
+
+
+def _union_rects_mask(rects, w, h):
+    """``h`` x ``w`` float32 union of filled ``(x1, y1, x2, y2)`` rectangles,
+    computed as one ``[h, N] @ [N, w]`` product of per-axis coverage."""
+    rects = torch.as_tensor(np.asarray(rects, dtype=np.int64).reshape(-1, 4))
+    xs, ys = torch.arange(w), torch.arange(h)
+    in_x = ((xs[None, :] >= rects[:, 0:1]) & (xs[None, :] < rects[:, 2:3])).float()
+    in_y = ((ys[None, :] >= rects[:, 1:2]) & (ys[None, :] < rects[:, 3:4])).float()
+    return (in_y.T @ in_x > 0).float()
+
+
 class DeepFaceBBoxDetector:
     """
     Wrapper for DeepFace to act as a ComfyUI-Impact-Pack BBOX_DETECTOR.
+
+    ``detect`` keeps the Impact Pack contract (first image of the batch);
+    ``detect_batch`` returns one SEGS per frame. SEG masks are float32 at
+    crop-region size, with the dilation applied to the face rectangles
+    analytically instead of with a per-mask morphology pass.
     """
     def __init__(self, detector_backend: str, align: bool = False):
         self.detector_backend = detector_backend
         self.align = align
 
+    def _frame_detections(self, image, threshold):
+        """Per frame: ``(h, w)`` and the ``[N, 5]`` float array of
+        ``(x1, y1, x2, y2, score)`` faces above ``threshold``."""
+        imgs_np = (image.cpu().numpy() * 255).astype(np.uint8)
+        h, w = imgs_np.shape[1:3]
+        frames = []
+        for detections in _detect_faces_batch(imgs_np, self.detector_backend, self.align):
+            faces = np.array(
+                [(x, y, x + bw, y + bh, score) for x, y, bw, bh, score in detections if score > threshold],
+                dtype=np.float64,
+            ).reshape(-1, 5)
+            frames.append(((h, w), faces))
+        return frames
+
     def detect(self, image, threshold, dilation, crop_factor, drop_size=1, detailer_hook=None):
+        # image is (B, H, W, C). For Impact Pack, usually detect is called per-image (1, H, W, C)
+        return self.detect_batch(image[:1], threshold, dilation, crop_factor, drop_size, detailer_hook)[0]
+
+    def detect_batch(self, image, threshold, dilation, crop_factor, drop_size=1, detailer_hook=None):
+        """One Impact Pack SEGS ``((h, w), [SEG, ...])`` per frame of ``image``."""
+        empty = [((image.shape[1], image.shape[2]), []) for _ in range(image.shape[0])]
         if not DEEPFACE_AVAILABLE:
             print("⚠️ DeepFace library not found.")
-            return ((image.shape[1], image.shape[2]), [])
+            return empty
 
         # Impact Pack core / utils might be missing if user doesn't have it installed
         try:
-            import impact.core as core
             from impact.core import SEG
             import impact.utils as utils
         except ImportError:
             print("⚠️ ComfyUI-Impact-Pack not found. BBOX_DETECTOR output is not fully functional.")
-            return ((image.shape[1], image.shape[2]), [])
+            return empty
 
         drop_size = max(drop_size, 1)
 
-        # image is (B, H, W, C). For Impact Pack, usually detect is called per-image (1, H, W, C)
-        img_np = (image[0].cpu().numpy() * 255).astype(np.uint8)
-        h, w, _ = img_np.shape
-
-        try:
-            detections = DeepFace.extract_faces(
-                img_path=img_np,
-                detector_backend=self.detector_backend,
-                enforce_detection=False,
-                align=self.align,
-                grayscale=False,
-            )
-        except Exception as e:
-            print(f"⚠️ DeepFace error: {e}")
-            return ((h, w), [])
-
-        result = []
-        for i, d in enumerate(detections):
-            score = d.get("confidence", 1.0)
-            if score > threshold:
-                area = d["facial_area"]
-                bx, by, bw, bh = area["x"], area["y"], area["w"], area["h"]
-                
-                # BBox format for Impact Pack is usually [x1, y1, x2, y2]
-                x1, y1 = bx, by
-                x2, y2 = bx + bw, by + bh
-
-                if x2 - x1 > drop_size and y2 - y1 > drop_size:
-                    item_bbox = [x1, y1, x2, y2]
-                    
-                    # Impact Pack utils.make_crop_region
-                    crop_region = utils.make_crop_region(w, h, item_bbox, crop_factor)
-                    
-                    if detailer_hook is not None and hasattr(detailer_hook, "post_crop_region"):
-                        crop_region = detailer_hook.post_crop_region(w, h, item_bbox, crop_region)
-                        
-                    crop_x1, crop_y1, crop_x2, crop_y2 = crop_region
-                    
-                    # prepare cropped mask
-                    cropped_mask = np.zeros((crop_y2 - crop_y1, crop_x2 - crop_x1))
-                    
-                    # Safe clamping for mask assignment
-                    mask_y1 = max(0, y1 - crop_y1)
-                    mask_y2 = min(cropped_mask.shape[0], y2 - crop_y1)
-                    mask_x1 = max(0, x1 - crop_x1)
-                    mask_x2 = min(cropped_mask.shape[1], x2 - crop_x1)
-                    
-                    if mask_y2 > mask_y1 and mask_x2 > mask_x1:
-                        cropped_mask[mask_y1:mask_y2, mask_x1:mask_x2] = 1
-                        
-                    cropped_mask = utils.dilate_mask(cropped_mask, dilation)
-                    
-                    # label is string
-                    label = "face"
-                    item = SEG(None, cropped_mask, score, crop_region, item_bbox, label, None)
-                    result.append(item)
-
-        shape = h, w
-        segs = shape, result
-
-        if detailer_hook is not None and hasattr(detailer_hook, "post_detection"):
-            segs = detailer_hook.post_detection(segs)
-
-        return segs
+        frames = []
+        for (h, w), faces in self._frame_detections(image, threshold):
+            # BBox format for Impact Pack is [x1, y1, x2, y2]
+            bboxes = faces[:, :4].astype(np.int64)
+            keep = ((bboxes[:, 2] - bboxes[:, 0]) > drop_size) & ((bboxes[:, 3] - bboxes[:, 1]) > drop_size)
+            bboxes, scores = bboxes[keep], faces[keep, 4]
+
+            crop_regions = []
+            for item_bbox in bboxes.tolist():
+                crop_region = utils.make_crop_region(w, h, item_bbox, crop_factor)
+                if detailer_hook is not None and hasattr(detailer_hook, "post_crop_region"):
+                    crop_region = detailer_hook.post_crop_region(w, h, item_bbox, crop_region)
+                crop_regions.append([int(v) for v in crop_region])
+            frames.append(((h, w), bboxes, scores, np.array(crop_regions, dtype=np.int64).reshape(-1, 4)))
+
+        # Face rectangles of the whole batch in crop-region coordinates, dilated at once
+        bboxes = np.concatenate([f[1] for f in frames])
+        crop_regions = np.concatenate([f[3] for f in frames])
+        crop_w = crop_regions[:, 2] - crop_regions[:, 0]
+        crop_h = crop_regions[:, 3] - crop_regions[:, 1]
+        rects = bboxes - np.tile(crop_regions[:, :2], 2)
+        rects[:, [0, 2]] = rects[:, [0, 2]].clip(0, crop_w[:, None])
+        rects[:, [1, 3]] = rects[:, [1, 3]].clip(0, crop_h[:, None])
+        rects = iter(_dilate_rects(rects, dilation, crop_w, crop_h).tolist())
+
+        all_segs = []
+        for shape, bboxes, scores, crop_regions in frames:
+            result = []
+            for item_bbox, crop_region, score in zip(bboxes.tolist(), crop_regions.tolist(), scores.tolist()):
+                mx1, my1, mx2, my2 = next(rects)
+                cropped_mask = np.zeros((crop_region[3] - crop_region[1], crop_region[2] - crop_region[0]), dtype=np.float32)
+                if mx2 > mx1 and my2 > my1:
+                    cropped_mask[my1:my2, mx1:mx2] = 1.0
+                result.append(SEG(None, cropped_mask, score, crop_region, item_bbox, "face", None))
+
+            segs = shape, result
+            if detailer_hook is not None and hasattr(detailer_hook, "post_detection"):
+                segs = detailer_hook.post_detection(segs)
+            all_segs.append(segs)
+
+        return all_segs
 
     def detect_combined(self, image, threshold, dilation):
-        try:
-            from impact.core import segs_to_combined_mask
-            return segs_to_combined_mask(self.detect(image, threshold, dilation, 1.0))
-        except ImportError:
-            import torch
-            return torch.zeros((image.shape[1], image.shape[2]), dtype=torch.float32)
+        """Union of the dilated face boxes of the first frame as an ``(H, W)`` mask."""
+        h, w = image.shape[1], image.shape[2]
+        if not DEEPFACE_AVAILABLE:
+            return torch.zeros((h, w), dtype=torch.float32)
+
+        (h, w), faces = self._frame_detections(image[:1], threshold)[0]
+        rects = _dilate_rects(faces[:, :4].astype(np.int64).clip(0, [w, h, w, h]), dilation, w, h)
+        return _union_rects_mask(rects, w, h)
 
     def setAux(self, x):
         pass
@@ -125,6 +468,25 @@ class DeepFace_FaceCrop:
     """
     Detect and crop faces using the DeepFace library.
     Supports multiple backends: retinaface, yolov8, mediapipe, ssd, mtcnn.
+
+    ``detect_long_side`` runs detection on a copy downscaled to that long
+    side (0 = full resolution) and maps the boxes back; ``refine_faces``
+    re-detects each face on a full-resolution window around it. Crops are
+    always taken from the original pixels.
+
+    ``faces`` / ``face_masks`` / ``face_bboxes`` return every face above the
+    threshold from the same detection pass (frame order, largest first),
+    letterboxed to ``crop_size`` x ``crop_size``; the masks are 0 over the
+    padding. For batches ``face_bboxes`` holds one ``[K, 4]`` tensor per
+    frame so each face stays with its own frame.
+
+    Every frame of the IMAGE batch is processed. ``workers`` fans the frames
+    out to a thread pool where each worker runs its own detector instance
+    (with deepface < 0.0.90, ssd / centerface / mediapipe share one and
+    still detect one frame at a time). For batches, crops are resized to
+    ``crop_size`` x ``crop_size`` and stacked; a single image keeps its
+    native crop size. ``bboxes`` lists the crop box of every frame (the
+    whole frame where no face was found).
     """
 
     @classmethod
@@ -157,10 +519,31 @@ class DeepFace_FaceCrop:
                 "force_square": ("BOOLEAN", {"default": True}),
                 "align": ("BOOLEAN", {"default": False, "label": "Align Face"}),
             },
+            "optional": {
+                "detect_long_side": (
+                    "INT",
+                    {"default": 0, "min": 0, "max": 8192, "step": 64},
+                ),
+                "refine_faces": ("BOOLEAN", {"default": False}),
+                "crop_size": (
+                    "INT",
+                    {"default": 512, "min": 64, "max": 4096, "step": 8},
+                ),
+                "workers": ("INT", {
+                    "default": 1, "min": 0, "max": 64,
+                    "tooltip": (
+                        "Parallel detection workers for batches (0 = one per CPU core), each with its own "
+                        "detector instance. With deepface < 0.0.90, ssd / centerface / mediapipe run one frame at a time."
+                    ),
+                }),
+            },
         }
 
-    RETURN_TYPES = ("IMAGE", "MASK", "INT", "INT", "INT", "INT", "BBOX_DETECTOR")
-    RETURN_NAMES = ("cropped_image", "mask", "bbox_x", "bbox_y", "bbox_w", "bbox_h", "bbox_detector")
+    RETURN_TYPES = ("IMAGE", "MASK", "INT", "INT", "INT", "INT", "BBOX_DETECTOR", "IMAGE", "MASK", "BBOX", "BBOX")
+    RETURN_NAMES = (
+        "cropped_image", "mask", "bbox_x", "bbox_y", "bbox_w", "bbox_h", "bbox_detector",
+        "faces", "face_masks", "face_bboxes", "bboxes",
+    )
     FUNCTION = "crop_face"
     CATEGORY = "Midnight Look/Face"
 
@@ -173,6 +556,10 @@ class DeepFace_FaceCrop:
         confidence_thresh: float,
         force_square: bool,
         align: bool,
+        detect_long_side: int = 0,
+        refine_faces: bool = False,
+        crop_size: int = 512,
+        workers: int = 1,
     ):
         if not DEEPFACE_AVAILABLE:
             raise ImportError(
@@ -180,115 +567,99 @@ class DeepFace_FaceCrop:
                 "pip install deepface"
             )
 
-        # 1. Tensor -> Numpy (B, H, W, C) -> (H, W, C) RGB uint8
-        batch_size = image.shape[0]
-        if batch_size > 1:
-            print(f"⚠️ DeepFace_FaceCrop: Processing first image only (Batch={batch_size})")
-
-        img_np = (image[0].cpu().numpy() * 255).astype(np.uint8)
-        h_img, w_img, _ = img_np.shape
+        # 1. Tensor -> Numpy (B, H, W, C) RGB uint8
+        batch_size, h_img, w_img, _ = image.shape
+        imgs_np = (image.cpu().numpy() * 255).astype(np.uint8)
 
-        # 2. Run DeepFace detection
-        # extract_faces returns a list of dicts
-        # target_size is ignored if enforce_detection=False usually, but 
-        # let's just use the raw extraction.
+        # 2. Run DeepFace detection on every frame
         # DeepFace expects BGR if using opencv path, but numpy array is usually 
         # assumed RGB by some backends or BGR by others. 
         # DeepFace internals usually convert to BGR.
-        
-        try:
-            detections = DeepFace.extract_faces(
-                img_path=img_np,
-                detector_backend=detector_backend,
-                enforce_detection=False,  # Don't crash if no face
-                align=align,
-                grayscale=False,
-            )
-        except Exception as e:
-            print(f"⚠️ DeepFace error: {e}")
-            return self._passthrough(image, h_img, w_img)
-
-        # Filter by confidence
-        valid_detections = []
-        for d in detections:
-            # DeepFace returns 'confidence' key (0-1 approx, backend dependent)
-            # Some backends might not return confidence, defaulting to 1.0
-            score = d.get("confidence", 0.0)
-            if score >= confidence_thresh:
-                valid_detections.append(d)
-
-        if not valid_detections:
-            print(f"⚠️ DeepFace ({detector_backend}): No faces above threshold {confidence_thresh}")
-            return self._passthrough(image, h_img, w_img)
-
-        # 3. Sort by Area (largest first)
-        # DeepFace returns 'facial_area': {'x': int, 'y': int, 'w': int, 'h': int}
-        valid_detections.sort(
-            key=lambda x: x["facial_area"]["w"] * x["facial_area"]["h"],
-            reverse=True,
+        all_detections = _detect_faces_batch(
+            imgs_np, detector_backend, align, detect_long_side, refine_faces,
+            workers if workers > 0 else (os.cpu_count() or 1),
         )
+        print(f"⚡ DeepFace: {stats_line()}")
+
+        boxes, face_crops = [], []
+        for i, detections in enumerate(all_detections):
+            # Filter by confidence
+            valid_detections = [d for d in detections if d[4] >= confidence_thresh]
+            if not valid_detections:
+                frame = f" in frame {i}" if batch_size > 1 else ""
+                print(f"⚠️ DeepFace ({detector_backend}): No faces above threshold {confidence_thresh}{frame}")
+                boxes.append(None)
+                continue
+
+            # 3. Sort by Area (largest first)
+            valid_detections.sort(key=lambda d: d[2] * d[3], reverse=True)
+
+            # All faces, from the same detections
+            face_crops += [
+                (i, box)
+                for box in (
+                    padded_crop_box(d, padding_factor, force_square, w_img, h_img)
+                    for d in valid_detections
+                )
+                if box is not None
+            ]
+
+            idx = face_index
+            if idx >= len(valid_detections):
+                print(f"⚠️ Face index {face_index} out of range. Using 0.")
+                idx = 0
+
+            # 4-6. Padding, square crop, clamp
+            boxes.append(
+                padded_crop_box(valid_detections[idx], padding_factor, force_square, w_img, h_img)
+            )
 
-        if face_index >= len(valid_detections):
-            print(f"⚠️ Face index {face_index} out of range. Using 0.")
-            face_index = 0
-
-        target = valid_detections[face_index]
-        area = target["facial_area"]
-        
-        # 4. Compute bbox with padding
-        x, y, w, h = area["x"], area["y"], area["w"], area["h"]
-        
-        # Convert to float for calculation
-        abs_x, abs_y, abs_w, abs_h = float(x), float(y), float(w), float(h)
-        
-        pad_w = abs_w * padding_factor
-        pad_h = abs_h * padding_factor
-
-        x1 = abs_x - pad_w / 2
-        y1 = abs_y - pad_h / 2
-        x2 = abs_x + abs_w + pad_w / 2
-        y2 = abs_y + abs_h + pad_h / 2
-
-        # 5. Square crop
-        if force_square:
-            cx = (x1 + x2) / 2
-            cy = (y1 + y2) / 2
-            side = max(x2 - x1, y2 - y1)
-            x1 = cx - side / 2
-            y1 = cy - side / 2
-            x2 = cx + side / 2
-            y2 = cy + side / 2
-
-        # 6. Clamp
-        x1 = int(max(0, x1))
-        y1 = int(max(0, y1))
-        x2 = int(min(w_img, x2))
-        y2 = int(min(h_img, y2))
-        
-        crop_w = x2 - x1
-        crop_h = y2 - y1
-
-        if crop_w <= 0 or crop_h <= 0:
-            return self._passthrough(image, h_img, w_img)
-
-        # 7. Crop
-        cropped_np = img_np[y1:y2, x1:x2, :]
-
-        # 8. Output
-        cropped_tensor = (
-            torch.from_numpy(cropped_np.astype(np.float32) / 255.0)
-            .unsqueeze(0)
-        )
-        mask = torch.ones((1, crop_h, crop_w), dtype=torch.float32)
+        faces, face_masks = letterbox_crops(imgs_np, face_crops, crop_size)
+        all_faces = (faces, face_masks, crop_bboxes(face_crops, batch_size))
+        bboxes = [
+            torch.tensor(box or (0, 0, w_img, h_img), dtype=torch.int64)
+            for box in boxes
+        ]
 
-        print(
-            f"✅ DeepFace ({detector_backend}): Cropped face at "
-            f"[x={x1}, y={y1}, w={crop_w}, h={crop_h}]"
-        )
+        if batch_size == 1:
+            if boxes[0] is None:
+                return self._passthrough(image, h_img, w_img) + all_faces + (bboxes,)
+
+            x1, y1, x2, y2 = boxes[0]
+            crop_w = x2 - x1
+            crop_h = y2 - y1
+
+            # 7. Crop
+            cropped_np = imgs_np[0, y1:y2, x1:x2, :]
+
+            # 8. Output
+            cropped_tensor = (
+                torch.from_numpy(cropped_np.astype(np.float32) / 255.0)
+                .unsqueeze(0)
+            )
+            mask = torch.ones((1, crop_h, crop_w), dtype=torch.float32)
+
+            print(
+                f"✅ DeepFace ({detector_backend}): Cropped face at "
+                f"[x={x1}, y={y1}, w={crop_w}, h={crop_h}]"
+            )
+        else:
+            # Batches: resize every crop to a common size so they stack
+            cropped_tensor = stack_crops(imgs_np, [box or (0, 0, w_img, h_img) for box in boxes], crop_size)
+            mask = torch.ones((batch_size, crop_size, crop_size), dtype=torch.float32)
+            x1, y1, x2, y2 = boxes[0] or (0, 0, w_img, h_img)
+            crop_w = x2 - x1
+            crop_h = y2 - y1
+
+            found = sum(box is not None for box in boxes)
+            print(
+                f"✅ DeepFace ({detector_backend}): Cropped faces in {found}/{batch_size} "
+                f"frame(s) at {crop_size}x{crop_size}"
+            )
 
         detector_obj = DeepFaceBBoxDetector(detector_backend=detector_backend, align=align)
 
-        return (cropped_tensor, mask, x1, y1, crop_w, crop_h, detector_obj)
+        return (cropped_tensor, mask, x1, y1, crop_w, crop_h, detector_obj) + all_faces + (bboxes,)
 
     @staticmethod
     def _passthrough(image, h, w):
@@ -302,6 +673,14 @@ class DeepFace_Verify:
     """
     Verify face identity using DeepFace models (commercial friendly).
     Models: Facenet, Facenet512, OpenFace, SFace.
+
+    ``image1[0]`` is the reference; its embeddings are cached by content,
+    model and detector, so a fixed reference photo is embedded once. Every
+    image of the ``image2`` batch is embedded and compared against it in
+    one distance computation (the closest pair of faces counts, as in
+    ``DeepFace.verify``). ``distance`` / ``is_match`` describe ``image2[0]``;
+    ``distances`` / ``match_mask`` list every item, and ``verified_image``
+    blacks out the items that do not match.
     """
 
     @classmethod
@@ -333,8 +712,9 @@ class DeepFace_Verify:
             },
         }
 
-    RETURN_TYPES = ("FLOAT", "BOOLEAN", "IMAGE", "STRING")
-    RETURN_NAMES = ("distance", "is_match", "verified_image", "info_text")
+    RETURN_TYPES = ("FLOAT", "BOOLEAN", "IMAGE", "STRING", "FLOAT", "BOOLEAN")
+    RETURN_NAMES = ("distance", "is_match", "verified_image", "info_text", "distances", "match_mask")
+    OUTPUT_IS_LIST = (False, False, False, False, True, True)
     FUNCTION = "verify"
     CATEGORY = "Midnight Look/Face"
     OUTPUT_NODE = True
@@ -360,9 +740,10 @@ class DeepFace_Verify:
         if not DEEPFACE_AVAILABLE:
             raise ImportError("DeepFace library not found. pip install deepface")
 
-        # Preprocess: Tensor [B,H,W,C] -> Numpy [H,W,C] (uint8)
+        # Preprocess: Tensor [B,H,W,C] -> Numpy (uint8)
         img1_np = (image1[0].cpu().numpy() * 255).astype(np.uint8)
-        img2_np = (image2[0].cpu().numpy() * 255).astype(np.uint8)
+        imgs2_np = (image2.cpu().numpy() * 255).astype(np.uint8)
+        batch_size = imgs2_np.shape[0]
 
         # Clean model_name (strip path prefixes)
         if "/" in model_name:
@@ -375,23 +756,27 @@ class DeepFace_Verify:
             (model_name, distance_metric), threshold
         )
 
-        # Run Verify
+        # Run Verify: cached reference, one embedding pass per candidate
         try:
-            result = DeepFace.verify(
-                img1_path=img1_np,
-                img2_path=img2_np,
-                model_name=model_name,
-                detector_backend=detector_backend,
-                distance_metric=distance_metric,
-                enforce_detection=False,
-                align=True,
-            )
+            reference = _reference_embeddings(img1_np, model_name, detector_backend)
+            candidates = [_represent(img_np, model_name, detector_backend) for img_np in imgs2_np]
         except Exception as e:
             print(f"⚠️ DeepFace Verify Error: {e}")
-            return (1.0, False, torch.zeros_like(image2), f"Error: {e}")
-
-        dist = result.get("distance", 1.0)
-        is_match = dist <= threshold
+            return (1.0, False, torch.zeros_like(image2), f"Error: {e}", [1.0] * batch_size, [False] * batch_size)
+        print(f"⚡ DeepFace Verify: {_reference_cache.stats_line()}")
+
+        # Closest (reference face, candidate face) pair per item, all at once
+        counts = np.array([len(c) for c in candidates])
+        distances = np.full(batch_size, np.inf)
+        if len(reference) and counts.sum():
+            per_face = _pairwise_distances(reference, np.concatenate(candidates), distance_metric).min(axis=0)
+            has_face = counts > 0
+            offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            distances[has_face] = np.minimum.reduceat(per_face, offsets[has_face])
+        matches = distances <= threshold
+
+        dist = float(distances[0])
+        is_match = bool(matches[0])
 
         # Human-readable advice based on distance relative to recommended threshold
         if dist <= rec_thresh * 0.5:
@@ -410,24 +795,70 @@ class DeepFace_Verify:
             f"{icon} Dist: {dist:.4f} ({advice}) | "
             f"Thresh: {threshold} | Recommended: {rec_thresh}"
         )
+        if batch_size > 1:
+            info += f" | Matches: {int(matches.sum())}/{batch_size}"
         print(f"[DeepFace] {info}")
 
-        # Verified Image: Pass image2 if match, else black
-        if is_match:
-            verified_img = image2
-        else:
-            verified_img = torch.zeros_like(image2)
+        # Verified Image: Pass image2 items that match, else black
+        match_mask = torch.from_numpy(matches).to(image2.device)
+        verified_img = image2 * match_mask.view(-1, 1, 1, 1).to(image2.dtype)
+
+        return {
+            "ui": {"text": [info]},
+            "result": (dist, is_match, verified_img, info, distances.tolist(), matches.tolist()),
+        }
+
+
+class DeepFace_WarmUp:
+    """
+    Build DeepFace detector backends and recognition models ahead of the
+    first real call and keep them resident. Reports the build time and the
+    first-call latency of every model separately; models that are already
+    warm are reported without rebuilding.
+    """
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "detector_backends": ("STRING", {
+                    "default": "ssd",
+                    "tooltip": "Comma-separated: ssd, mtcnn, dlib, centerface, mediapipe, retinaface, ...",
+                }),
+                "model_names": ("STRING", {
+                    "default": "Facenet512",
+                    "tooltip": "Comma-separated: Facenet, Facenet512, OpenFace, SFace",
+                }),
+            },
+        }
+
+    RETURN_TYPES = ("STRING",)
+    RETURN_NAMES = ("info_text",)
+    FUNCTION = "warm_up"
+    CATEGORY = "Midnight Look/Face"
+    OUTPUT_NODE = True
+
+    def warm_up(self, detector_backends, model_names):
+        if not DEEPFACE_AVAILABLE:
+            raise ImportError("DeepFace library not found. pip install deepface")
+
+        _wait_for_warmup()
+        info = "\n".join(warm_up(_split_names(detector_backends), _split_names(model_names)))
+        return {"ui": {"text": [info]}, "result": (info,)}
+
 
-        return {"ui": {"text": [info]}, "result": (dist, is_match, verified_img, info)}
+_start_background_warmup()
 
 
 NODE_CLASS_MAPPINGS = {
     "DeepFace_FaceCrop": DeepFace_FaceCrop,
     "DeepFace_Verify": DeepFace_Verify,
+    "DeepFace_WarmUp": DeepFace_WarmUp,
 }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
     "DeepFace_FaceCrop": "Midnight Look : DeepFace Crop",
     "DeepFace_Verify": "Midnight Look : DeepFace Verify",
+    "DeepFace_WarmUp": "Midnight Look : DeepFace Warm Up",
 }
 
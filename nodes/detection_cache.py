@@ -0,0 +1,58 @@
+"""
+Shared Detection Cache
+======================
+One LRU cache of raw detector outputs shared by the face and segmentation
+nodes (MediaPipe_FaceCrop, DeepFace_FaceCrop, DeepFaceBBoxDetector,
+SAM2Loader's GroundingDINO pass, ...).
+
+Entries are keyed by ``(backend, params, image_hash(frame))`` where
+``frame`` is the uint8 HWC array every node already builds before
+detecting, so any node asking the same detector the same question about
+the same pixels gets the stored answer instead of running it again.
+``params`` must hold everything that changes the raw detections (model,
+thresholds applied by the detector itself, detection resolution, ...) but
+nothing applied afterwards (padding, face_index, ...).
+
+Cached values are shared between callers and must be treated as
+read-only; detections are stored as tuples.
+
+Size: ``MIDNIGHTLOOK_DETECTION_CACHE_ENTRIES`` frames (default 512,
+0 disables the cache).
+
+Dependencies: numpy
+"""
+
+import os
+
+from .cache import LRUCache, image_hash
+
+_MAX_ENTRIES = int(os.environ.get("MIDNIGHTLOOK_DETECTION_CACHE_ENTRIES", "512"))
+
+detection_cache = LRUCache("detections", max_entries=max(_MAX_ENTRIES, 0))
+
+
+def detection_key(backend, params, frame):
+    """Cache key for ``backend`` run with ``params`` on the uint8 ``frame``."""
+    return (backend, tuple(params), image_hash(frame))
+
+
+def cached_detections(backend, params, frame, detect_fn):
+    """Returns ``detect_fn(frame)`` as a tuple, from the cache when the same
+    backend/params already ran on the same pixels."""
+    if _MAX_ENTRIES <= 0:
+        return tuple(detect_fn(frame))
+
+    key = detection_key(backend, params, frame)
+    detections = detection_cache.get(key)
+    if detections is None:
+        detections = detection_cache.put(key, tuple(detect_fn(frame)))
+    return detections
+
+
+def stats():
+    """Hit/miss/eviction counters of the shared detection cache."""
+    return detection_cache.stats()
+
+
+def stats_line():
+    return detection_cache.stats_line()
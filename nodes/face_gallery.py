@@ -0,0 +1,360 @@
+"""
+Face Gallery Nodes
+==================
+Persistent face-identity galleries built on the same DeepFace models as
+``DeepFace_Verify``.
+
+A gallery lives in ``models/face_galleries/<name>/``:
+
+* ``embeddings-<n>.npy`` - ``[N, D]`` float32 matrix of L2-normalized rows,
+  one per reference (the largest face of each reference photo).
+* ``meta.json``          - the embeddings file to use, model / detector, and
+  the identity, source and original embedding norm of every row.
+
+Every build writes a new embeddings file and then swaps ``meta.json``, so
+a file that may be memory-mapped is never replaced (Windows refuses to)
+and readers only ever see rows that ``meta.json`` vouches for.
+
+Queries memory-map the embeddings file instead of re-embedding the
+references, and search all rows with one float32 matrix product against
+the map: cosine and euclidean_l2 only need the unit rows, euclidean
+rescales them with the stored norms.
+
+Dependencies: deepface, numpy, Pillow
+"""
+
+import glob
+import json
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+import folder_paths
+
+from .cache import LRUCache
+from .deepface_node import (
+    DEEPFACE_AVAILABLE,
+    DeepFace_Verify,
+    _represent,
+)
+
+_IMAGE_EXTENSIONS = ("png", "jpg", "jpeg", "webp", "bmp")
+
+# Loaded galleries keyed by directory, stored with their meta.json mtime; the matrices are memory-maps
+_gallery_cache = LRUCache("face galleries", max_entries=16)
+
+
+def _gallery_root():
+    """``models/face_galleries`` (case-insensitive match of an existing folder)."""
+    root = os.path.join(folder_paths.models_dir, "face_galleries")
+    if os.path.exists(folder_paths.models_dir):
+        for d in os.listdir(folder_paths.models_dir):
+            if d.lower() == "face_galleries" and os.path.isdir(os.path.join(folder_paths.models_dir, d)):
+                return os.path.join(folder_paths.models_dir, d)
+    return root
+
+
+def _gallery_dir(gallery_name):
+    name = os.path.basename(gallery_name.strip().replace("\\", "/").rstrip("/"))
+    if not name or name in (".", ".."):
+        raise ValueError(f"Invalid gallery name: '{gallery_name}'")
+    return os.path.join(_gallery_root(), name)
+
+
+def _normalize_rows(embeddings):
+    """``(unit rows as float32, row norms)`` of an ``[N, D]`` matrix."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1)
+    return embeddings / np.maximum(norms, 1e-12)[:, None], norms
+
+
+def load_gallery(gallery_name):
+    """Returns ``(embeddings, norms, meta)``: the L2-normalized rows
+    memory-mapped read-only and their original norms as float32."""
+    gallery_dir = _gallery_dir(gallery_name)
+    meta_path = os.path.join(gallery_dir, "meta.json")
+    if not os.path.isfile(meta_path):
+        raise FileNotFoundError(f"Face gallery '{gallery_name}' not found at {gallery_dir}")
+
+    mtime = os.stat(meta_path).st_mtime_ns
+    cached = _gallery_cache.get(gallery_dir)
+    if cached is None or cached[0] != mtime:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        embeddings_file = os.path.basename(meta.get("embeddings_file", "embeddings.npy"))
+        embeddings = np.load(os.path.join(gallery_dir, embeddings_file), mmap_mode="r")
+        if meta.get("normalized"):
+            norms = np.array([e["norm"] for e in meta["entries"]], dtype=np.float32)
+        else:
+            # Galleries from before rows were stored normalized: normalize in memory once
+            print(f"⚠️ FaceGallery: '{gallery_name}' stores raw embeddings; normalizing them in memory (rebuild it to avoid this).")
+            embeddings, norms = _normalize_rows(embeddings)
+        cached = _gallery_cache.put(gallery_dir, (mtime, embeddings, norms, meta))
+    return cached[1:]
+
+
+def _gallery_distances(queries, embeddings, norms, distance_metric):
+    """``[F, N]`` float32 distances between the ``[F, D]`` query embeddings
+    and the gallery's unit rows, with DeepFace's cosine / euclidean /
+    euclidean_l2 definitions, without copying the memory-map. Distances
+    near 0 are good to about ``sqrt(float32 eps)`` (times the norm for
+    euclidean), far below any match threshold; DeepFace_Verify keeps the
+    exact float64 form."""
+    queries, query_norms = _normalize_rows(queries)
+    similarity = queries @ embeddings.T
+    if distance_metric == "cosine":
+        return 1.0 - similarity
+    if distance_metric == "euclidean_l2":
+        return np.sqrt(np.maximum(2.0 - 2.0 * similarity, 0.0))
+    squared = (
+        query_norms[:, None] ** 2 + norms[None, :] ** 2
+        - 2.0 * query_norms[:, None] * norms[None, :] * similarity
+    )
+    return np.sqrt(np.maximum(squared, 0.0))
+
+
+def _save_gallery(gallery_name, embeddings, meta):
+    """
+    Writes the rows to a new embeddings file, then swaps ``meta.json`` to
+    point at it, so readers never see a half-written gallery and a file
+    that may still be memory-mapped is never replaced. Superseded
+    embeddings files are removed once nothing maps them any more.
+    """
+    gallery_dir = _gallery_dir(gallery_name)
+    os.makedirs(gallery_dir, exist_ok=True)
+
+    embeddings_file = f"embeddings-{time.time_ns()}.npy"
+    emb_path = os.path.join(gallery_dir, embeddings_file)
+    meta_path = os.path.join(gallery_dir, "meta.json")
+    with open(emb_path + ".tmp", "wb") as f:
+        np.save(f, np.ascontiguousarray(embeddings, dtype=np.float32))
+    os.replace(emb_path + ".tmp", emb_path)
+    with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(dict(meta, embeddings_file=embeddings_file), f, indent=2)
+    os.replace(meta_path + ".tmp", meta_path)
+
+    # Release our map of the old rows, then clean up the files nothing points to
+    _gallery_cache.pop(gallery_dir)
+    for path in glob.glob(os.path.join(gallery_dir, "embeddings*.npy")):
+        if os.path.basename(path) != embeddings_file:
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # still mapped elsewhere (Windows); removed by a later build
+    return gallery_dir
+
+
+def _folder_images(folder):
+    """``(identity, source, uint8 image)`` for every image under ``folder``.
+    Images in a sub-folder take the sub-folder name as identity."""
+    folder = os.path.abspath(folder)
+    paths = sorted(
+        p for ext in _IMAGE_EXTENSIONS
+        for p in glob.glob(os.path.join(folder, "**", f"*.{ext}"), recursive=True)
+    )
+    for path in paths:
+        parent = os.path.relpath(os.path.dirname(path), folder)
+        identity = None if parent == "." else parent.replace(os.sep, "/")
+        yield identity, os.path.relpath(path, folder), np.array(Image.open(path).convert("RGB"))
+
+
+class FaceGallery_Build:
+    """
+    Embed reference photos into a persistent face gallery.
+
+    References come from the ``images`` batch (all labelled ``identity``)
+    and/or an image ``folder`` (files in sub-folders are labelled with the
+    sub-folder name, files directly in it with ``identity``). "append" adds
+    to an existing gallery built with the same model and detector.
+    """
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "gallery_name": ("STRING", {"default": "customer"}),
+                "identity": ("STRING", {"default": "customer"}),
+                "model_name": (
+                    ["Facenet", "Facenet512", "OpenFace", "SFace"],
+                    {"default": "Facenet512"},
+                ),
+                "detector_backend": (
+                    ["ssd", "mtcnn", "dlib", "mediapipe", "retinaface"],
+                    {"default": "ssd"},
+                ),
+                "mode": (["overwrite", "append"], {"default": "overwrite"}),
+            },
+            "optional": {
+                "images": ("IMAGE",),
+                "folder": ("STRING", {"default": ""}),
+            },
+        }
+
+    RETURN_TYPES = ("STRING", "STRING")
+    RETURN_NAMES = ("gallery_name", "info_text")
+    FUNCTION = "build"
+    CATEGORY = "Midnight Look/Face"
+    OUTPUT_NODE = True
+
+    def build(self, gallery_name, identity, model_name, detector_backend, mode, images=None, folder=""):
+        if not DEEPFACE_AVAILABLE:
+            raise ImportError("DeepFace library not found. pip install deepface")
+
+        references = []
+        if images is not None:
+            imgs_np = (images.cpu().numpy() * 255).astype(np.uint8)
+            references += [(identity, f"batch[{i}]", img_np) for i, img_np in enumerate(imgs_np)]
+        if folder and folder.strip():
+            if not os.path.isdir(folder.strip()):
+                raise FileNotFoundError(f"Reference folder not found: {folder}")
+            references += [(ident or identity, source, img_np) for ident, source, img_np in _folder_images(folder.strip())]
+        if not references:
+            raise ValueError("FaceGallery_Build: No reference images (connect images or set folder).")
+
+        embeddings, entries = [], []
+        for ident, source, img_np in references:
+            try:
+                embedding = _represent(img_np, model_name, detector_backend, largest_only=True)
+            except Exception as e:
+                print(f"⚠️ FaceGallery_Build: Skipping {source}: {e}")
+                continue
+            if len(embedding):
+                embeddings.append(embedding[0])
+                entries.append({"identity": ident, "source": source})
+
+        if not embeddings:
+            raise RuntimeError("FaceGallery_Build: No reference could be embedded.")
+        embeddings, norms = _normalize_rows(np.stack(embeddings))
+        for entry, norm in zip(entries, norms):
+            entry["norm"] = float(norm)
+
+        if mode == "append":
+            try:
+                old_embeddings, old_norms, old_meta = load_gallery(gallery_name)
+            except FileNotFoundError:
+                old_embeddings, old_norms, old_meta = None, None, None
+            if old_meta is not None:
+                if (old_meta["model_name"], old_meta["detector_backend"]) != (model_name, detector_backend):
+                    raise ValueError(
+                        f"Gallery '{gallery_name}' was built with {old_meta['model_name']} / "
+                        f"{old_meta['detector_backend']}; append with the same model and detector."
+                    )
+                # Copy the old rows out of the memory-map and drop it, so nothing keeps it open past the save
+                embeddings = np.concatenate([np.array(old_embeddings), embeddings])
+                old_embeddings = None
+                entries = [dict(e, norm=float(n)) for e, n in zip(old_meta["entries"], old_norms)] + entries
+
+        meta = {
+            "model_name": model_name,
+            "detector_backend": detector_backend,
+            "dim": int(embeddings.shape[1]),
+            "normalized": True,
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "entries": entries,
+        }
+        gallery_dir = _save_gallery(gallery_name, embeddings, meta)
+
+        identities = sorted({e["identity"] for e in entries})
+        info = (
+            f"✅ Gallery '{gallery_name}': {len(entries)} reference(s), "
+            f"{len(identities)} identit{'y' if len(identities) == 1 else 'ies'} "
+            f"({model_name}/{detector_backend}, dim {meta['dim']}) -> {gallery_dir}"
+        )
+        print(f"[FaceGallery] {info}")
+        return {"ui": {"text": [info]}, "result": (gallery_name, info)}
+
+
+class FaceGallery_Query:
+    """
+    Search a face gallery with the faces of ``image``.
+
+    Every image of the batch is embedded once with the gallery's own model
+    and detector, and compared against all references in one vectorized
+    distance computation (the closest face of the image counts).
+    ``best_distance`` / ``identity`` / ``is_match`` describe ``image[0]``,
+    ``reference_scores`` lists its distance to every reference in gallery
+    order; ``info_text`` lists the top-k references of every image.
+    """
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "image": ("IMAGE",),
+                "gallery_name": ("STRING", {"default": "customer"}),
+                "distance_metric": (
+                    ["cosine", "euclidean", "euclidean_l2"],
+                    {"default": "cosine"},
+                ),
+                "threshold": ("FLOAT", {
+                    "default": 0.30, "min": 0.0, "max": 100.0, "step": 0.01,
+                    "tooltip": "Distance threshold. LOWER = STRICTER. Values below threshold = Match.",
+                }),
+                "top_k": ("INT", {"default": 5, "min": 1, "max": 100}),
+            },
+        }
+
+    RETURN_TYPES = ("FLOAT", "STRING", "BOOLEAN", "FLOAT", "STRING")
+    RETURN_NAMES = ("best_distance", "identity", "is_match", "reference_scores", "info_text")
+    OUTPUT_IS_LIST = (False, False, False, True, False)
+    FUNCTION = "query"
+    CATEGORY = "Midnight Look/Face"
+    OUTPUT_NODE = True
+
+    def query(self, image, gallery_name, distance_metric, threshold, top_k):
+        if not DEEPFACE_AVAILABLE:
+            raise ImportError("DeepFace library not found. pip install deepface")
+
+        embeddings, norms, meta = load_gallery(gallery_name)
+        model_name, detector_backend = meta["model_name"], meta["detector_backend"]
+        entries = meta["entries"]
+
+        imgs_np = (image.cpu().numpy() * 255).astype(np.uint8)
+        queries = [_represent(img_np, model_name, detector_backend) for img_np in imgs_np]
+        counts = np.array([len(q) for q in queries])
+
+        # [B, N]: closest face of each image to every reference
+        scores = np.full((len(queries), len(entries)), np.inf, dtype=np.float32)
+        if counts.sum():
+            per_face = _gallery_distances(np.concatenate(queries), embeddings, norms, distance_metric)
+            has_face = counts > 0
+            offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            scores[has_face] = np.minimum.reduceat(per_face, offsets[has_face], axis=0)
+
+        k = min(top_k, len(entries))
+        top = np.argpartition(scores, k - 1, axis=1)[:, :k]
+        top = np.take_along_axis(top, np.argsort(np.take_along_axis(scores, top, axis=1), axis=1), axis=1)
+
+        rec_thresh = DeepFace_Verify.RECOMMENDED_THRESHOLDS.get((model_name, distance_metric), threshold)
+        lines = []
+        for i, row in enumerate(top):
+            ranked = ", ".join(f"{entries[j]['identity']} ({entries[j]['source']}): {scores[i, j]:.4f}" for j in row)
+            icon = "✅" if scores[i, row[0]] <= threshold else "⛔"
+            lines.append(f"{icon} [{i}] {ranked}")
+        info = (
+            f"Gallery '{gallery_name}' ({model_name}/{detector_backend}, {len(entries)} refs) | "
+            f"Thresh: {threshold} | Recommended: {rec_thresh}\n" + "\n".join(lines)
+        )
+        print(f"[FaceGallery] {info}")
+
+        best = int(top[0, 0])
+        best_distance = float(scores[0, best])
+        is_match = best_distance <= threshold
+        identity = entries[best]["identity"] if np.isfinite(best_distance) else ""
+        return {
+            "ui": {"text": [info]},
+            "result": (best_distance, identity, is_match, scores[0].tolist(), info),
+        }
+
+
+NODE_CLASS_MAPPINGS = {
+    "FaceGallery_Build": FaceGallery_Build,
+    "FaceGallery_Query": FaceGallery_Query,
+}
+
+NODE_DISPLAY_NAME_MAPPINGS = {
+    "FaceGallery_Build": "Midnight Look : Face Gallery Build",
+    "FaceGallery_Query": "Midnight Look : Face Gallery Query",
+}
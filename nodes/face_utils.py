@@ -0,0 +1,200 @@
+"""
+Face Detection Helpers
+======================
+Shared by the MediaPipe and DeepFace face crop nodes.
+
+Detections are plain ``(x, y, w, h, score)`` tuples in pixel coordinates
+of the image they were detected on, so every backend can use the same
+padding / squaring and the same reduced-resolution detection pyramid:
+
+* ``detect_pyramid`` runs a detector on a copy downscaled to a target
+  long side, maps the boxes back to full resolution and can optionally
+  refine each face by re-detecting on a full-resolution window around it.
+* ``padded_crop_box`` turns a detection into the clamped crop box used by
+  the nodes. Crops are always taken from the original pixels.
+* ``letterbox_crops`` stacks crops of any aspect into one fixed-size batch
+  for the nodes' all-faces outputs; ``stack_crops`` stretches one crop per
+  frame to a common size for batch outputs; ``crop_bboxes`` gives the
+  matching BBOX list.
+
+Dependencies: numpy, Pillow, torch
+"""
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+
+def downscale_for_detection(img_np: np.ndarray, long_side: int):
+    """Return ``(image, scale)`` with the longer side reduced to
+    ``long_side`` (``scale`` = new / original). Images that are already
+    small enough, or ``long_side <= 0``, are returned unchanged."""
+    h, w = img_np.shape[:2]
+    if long_side <= 0 or max(h, w) <= long_side:
+        return img_np, 1.0
+
+    scale = long_side / float(max(h, w))
+    size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+    small = Image.fromarray(img_np).resize(size, Image.BILINEAR, reducing_gap=2.0)
+    return np.asarray(small), scale
+
+
+def box_iou(a, b) -> float:
+    """IoU of two ``(x, y, w, h, ...)`` boxes."""
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[0] + a[2], b[0] + b[2]), min(a[1] + a[3], b[1] + b[3])
+    inter = max(0.0, ix2 - ix1) * max(0.0, iy2 - iy1)
+    union = a[2] * a[3] + b[2] * b[3] - inter
+    return inter / union if union > 0 else 0.0
+
+
+def _refine_box(img_np, box, detect_fn, margin, max_side):
+    """Re-detect ``box`` on a full-resolution window around it; keeps the
+    coarse box if the window has no overlapping detection."""
+    h, w = img_np.shape[:2]
+    x, y, bw, bh, score = box
+    pad = margin * max(bw, bh)
+    x1, y1 = int(max(0, x - pad)), int(max(0, y - pad))
+    x2, y2 = int(min(w, x + bw + pad)), int(min(h, y + bh + pad))
+    if x2 - x1 < 2 or y2 - y1 < 2:
+        return box
+
+    window, scale = downscale_for_detection(img_np[y1:y2, x1:x2], max_side)
+    candidates = [
+        (cx / scale + x1, cy / scale + y1, cw / scale, ch / scale, cs)
+        for cx, cy, cw, ch, cs in detect_fn(np.ascontiguousarray(window))
+    ]
+    if not candidates:
+        return box
+
+    best = max(candidates, key=lambda c: box_iou(c, box))
+    return best if box_iou(best, box) >= 0.3 else box
+
+
+def detect_pyramid(img_np, detect_fn, detect_long_side=0, refine=False, refine_margin=0.5, refine_fn=None):
+    """
+    Run ``detect_fn(image) -> [(x, y, w, h, score), ...]`` on a copy of
+    ``img_np`` downscaled to ``detect_long_side`` (0 = full resolution)
+    and return the boxes in full-resolution coordinates.
+
+    With ``refine``, every box found on the downscaled copy is re-detected
+    with ``refine_fn`` (default ``detect_fn``) on a window of
+    ``refine_margin`` face sizes around it, at full resolution (capped at
+    twice ``detect_long_side``).
+    """
+    small, scale = downscale_for_detection(img_np, detect_long_side)
+    boxes = detect_fn(small)
+    if scale == 1.0:
+        return list(boxes)
+
+    boxes = [(x / scale, y / scale, w / scale, h / scale, s) for x, y, w, h, s in boxes]
+    if refine:
+        boxes = [_refine_box(img_np, box, refine_fn or detect_fn, refine_margin, 2 * detect_long_side) for box in boxes]
+    return boxes
+
+
+def padded_crop_box(box, padding_factor, force_square, img_w, img_h):
+    """Padded (and optionally squared) crop box ``(x1, y1, x2, y2)`` of a
+    detection, clamped to the image, or None if it is empty."""
+    abs_x, abs_y, abs_w, abs_h = (float(v) for v in box[:4])
+
+    # Padding
+    pad_w = abs_w * padding_factor
+    pad_h = abs_h * padding_factor
+
+    x1 = abs_x - pad_w / 2
+    y1 = abs_y - pad_h / 2
+    x2 = abs_x + abs_w + pad_w / 2
+    y2 = abs_y + abs_h + pad_h / 2
+
+    # Force Square
+    if force_square:
+        cx = (x1 + x2) / 2
+        cy = (y1 + y2) / 2
+        side = max(x2 - x1, y2 - y1)
+        x1 = cx - side / 2
+        y1 = cy - side / 2
+        x2 = cx + side / 2
+        y2 = cy + side / 2
+
+    # Clamp
+    x1 = int(max(0, x1))
+    y1 = int(max(0, y1))
+    x2 = int(min(img_w, x2))
+    y2 = int(min(img_h, y2))
+
+    if x2 - x1 <= 0 or y2 - y1 <= 0:
+        return None
+    return (x1, y1, x2, y2)
+
+
+def _resize_crop(crop_np, new_h, new_w):
+    """uint8 HWC crop -> float [new_h, new_w, C] with antialiased bilinear."""
+    crop = torch.from_numpy(crop_np.astype(np.float32) / 255.0)
+    crop = F.interpolate(
+        crop.permute(2, 0, 1).unsqueeze(0),
+        size=(new_h, new_w),
+        mode="bilinear",
+        align_corners=False,
+        antialias=True,
+    )
+    return crop[0].permute(1, 2, 0).clamp(0.0, 1.0)
+
+
+def stack_crops(imgs_np, boxes, size):
+    """Crop ``boxes[i] = (x1, y1, x2, y2)`` from frame ``i`` of the uint8
+    ``imgs_np`` batch, resize each to ``size`` x ``size`` and stack them."""
+    return torch.stack([
+        _resize_crop(img_np[y1:y2, x1:x2, :], size, size)
+        for img_np, (x1, y1, x2, y2) in zip(imgs_np, boxes)
+    ])
+
+
+def letterbox_crops(imgs_np, crops, size):
+    """
+    Letterbox every ``(frame_index, (x1, y1, x2, y2))`` crop of the uint8
+    ``imgs_np`` batch into a ``size`` x ``size`` square (aspect kept,
+    centred, black padding).
+
+    Returns ``(images [N, size, size, 3], masks [N, size, size])`` where a
+    mask is 1 over the crop's pixels and 0 over the padding. With no crops,
+    a single black image with an empty mask is returned so downstream nodes
+    still receive a valid batch.
+    """
+    if not crops:
+        return (
+            torch.zeros((1, size, size, 3), dtype=torch.float32),
+            torch.zeros((1, size, size), dtype=torch.float32),
+        )
+
+    images = torch.zeros((len(crops), size, size, 3), dtype=torch.float32)
+    masks = torch.zeros((len(crops), size, size), dtype=torch.float32)
+    for n, (i, (x1, y1, x2, y2)) in enumerate(crops):
+        crop_w, crop_h = x2 - x1, y2 - y1
+        scale = size / float(max(crop_w, crop_h))
+        new_w = min(size, max(1, int(round(crop_w * scale))))
+        new_h = min(size, max(1, int(round(crop_h * scale))))
+
+        crop = _resize_crop(imgs_np[i, y1:y2, x1:x2, :], new_h, new_w)
+
+        top, left = (size - new_h) // 2, (size - new_w) // 2
+        images[n, top:top + new_h, left:left + new_w] = crop
+        masks[n, top:top + new_h, left:left + new_w] = 1.0
+    return images, masks
+
+
+def crop_bboxes(crops, batch_size):
+    """
+    BBOX list for the ``(frame_index, (x1, y1, x2, y2))`` crops of
+    ``letterbox_crops``, in the layout of SAM2Loader's "all" mode: one
+    ``[4]`` tensor per face for a single image, one ``[K_i, 4]`` tensor per
+    frame for batches (``[0, 4]`` where a frame has no face), so
+    MidnightDetailer maps every face back onto its own frame.
+    """
+    if batch_size == 1:
+        return [torch.tensor(box, dtype=torch.int64) for _, box in crops]
+    per_frame = [[] for _ in range(batch_size)]
+    for i, box in crops:
+        per_frame[i].append(box)
+    return [torch.tensor(boxes, dtype=torch.int64).reshape(-1, 4) for boxes in per_frame]
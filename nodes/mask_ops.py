@@ -0,0 +1,113 @@
+"""
+Mask Refinement Ops
+===================
+Dilation / erosion and Gaussian feathering for MASK tensors, implemented with
+torch ops so the work stays on the mask's device (CPU or CUDA) and runs over a
+whole ``[B, H, W]`` batch at once.
+
+The torch path reproduces ``scipy.ndimage.grey_dilation`` / ``grey_erosion`` /
+``gaussian_filter`` (default ``mode="reflect"``, ``truncate=4.0``) including
+the kernel alignment scipy uses for even sizes. The scipy implementation is
+kept as a fallback.
+
+Dependencies: torch, numpy, scipy
+"""
+
+import numpy as np
+import scipy.ndimage
+import torch
+import torch.nn.functional as F
+
+
+def _as_batch(mask):
+    """Returns ``(mask[B, H, W] float32, squeeze)``; ``squeeze`` restores a 2D input."""
+    if mask.dim() == 2:
+        return mask.unsqueeze(0).float(), True
+    return mask.float(), False
+
+
+def _symmetric_indices(n, before, after, device):
+    """Index map equivalent to numpy/scipy ``reflect`` (edge-repeating) padding."""
+    idx = torch.arange(-before, n + after, device=device)
+    idx = torch.remainder(idx, 2 * n)
+    return torch.where(idx >= n, 2 * n - 1 - idx, idx)
+
+
+def _gaussian_kernel(sigma, device):
+    radius = int(4.0 * float(sigma) + 0.5)
+    x = torch.arange(-radius, radius + 1, device=device, dtype=torch.float64)
+    kernel = torch.exp(-0.5 * (x / float(sigma)) ** 2)
+    return (kernel / kernel.sum()).float(), radius
+
+
+def dilate_mask(mask, size):
+    """Grey dilation with a ``size x size`` square footprint (max-pool)."""
+    x, squeeze = _as_batch(mask)
+    if size > 1:
+        # scipy centres even footprints one pixel to the right/bottom for dilation
+        lo, hi = (size - 1) // 2, size // 2
+        x = F.pad(x.unsqueeze(1), (lo, hi, lo, hi), value=float("-inf"))
+        x = F.max_pool2d(x, kernel_size=size, stride=1).squeeze(1)
+    return x[0] if squeeze else x
+
+
+def erode_mask(mask, size):
+    """Grey erosion with a ``size x size`` square footprint (min-pool)."""
+    x, squeeze = _as_batch(mask)
+    if size > 1:
+        # ...and one pixel to the left/top for erosion
+        lo, hi = size // 2, (size - 1) // 2
+        x = F.pad(-x.unsqueeze(1), (lo, hi, lo, hi), value=float("-inf"))
+        x = -F.max_pool2d(x, kernel_size=size, stride=1).squeeze(1)
+    return x[0] if squeeze else x
+
+
+def gaussian_blur_mask(mask, sigma):
+    """Separable Gaussian blur matching ``scipy.ndimage.gaussian_filter(mode="reflect")``."""
+    x, squeeze = _as_batch(mask)
+    if sigma > 0:
+        kernel, radius = _gaussian_kernel(sigma, x.device)
+        b, h, w = x.shape
+
+        rows = _symmetric_indices(h, radius, radius, x.device)
+        x = x.index_select(1, rows)
+        x = F.conv2d(x.unsqueeze(1), kernel.view(1, 1, -1, 1)).squeeze(1)
+
+        cols = _symmetric_indices(w, radius, radius, x.device)
+        x = x.index_select(2, cols)
+        x = F.conv2d(x.unsqueeze(1), kernel.view(1, 1, 1, -1)).squeeze(1)
+    return x[0] if squeeze else x
+
+
+def refine_mask_torch(mask, mask_expand, mask_blur):
+    """Dilate (``mask_expand > 0``) or erode (``< 0``), then feather with ``sigma=mask_blur``."""
+    if mask_expand > 0:
+        mask = dilate_mask(mask, mask_expand)
+    elif mask_expand < 0:
+        mask = erode_mask(mask, -mask_expand)
+    return gaussian_blur_mask(mask, mask_blur)
+
+
+def refine_mask_scipy(mask, mask_expand, mask_blur):
+    """Reference CPU implementation; returns a tensor on the input's device."""
+    x, squeeze = _as_batch(mask)
+    out = []
+    for mask_np in x.cpu().numpy():
+        # Dilate or Erode mask
+        if mask_expand > 0:
+            mask_np = scipy.ndimage.grey_dilation(mask_np, size=(mask_expand, mask_expand))
+        elif mask_expand < 0:
+            mask_np = scipy.ndimage.grey_erosion(mask_np, size=(-mask_expand, -mask_expand))
+        # Gaussian blur for alpha blending feathering
+        out.append(scipy.ndimage.gaussian_filter(mask_np, sigma=mask_blur))
+    result = torch.from_numpy(np.stack(out)).float().to(x.device)
+    return result[0] if squeeze else result
+
+
+def refine_mask(mask, mask_expand, mask_blur):
+    """On-device refinement with an automatic fallback to the scipy path."""
+    try:
+        return refine_mask_torch(mask, mask_expand, mask_blur)
+    except Exception as e:
+        print(f"⚠️ MaskOps: torch mask refinement failed ({e}). Falling back to scipy.")
+        return refine_mask_scipy(mask, mask_expand, mask_blur)
@@ -12,8 +12,11 @@ Dependencies: mediapipe, torch, numpy
 
 from __future__ import annotations
 
+import atexit
 import os
+import threading
 import urllib.request
+from collections import OrderedDict
 
 import numpy as np
 import torch
@@ -26,6 +29,9 @@ from mediapipe.tasks.python.vision import (
     RunningMode,
 )
 
+from .detection_cache import cached_detections, stats_line
+from .face_utils import crop_bboxes, detect_pyramid, letterbox_crops, padded_crop_box, stack_crops
+
 # ---------------------------------------------------------------------- #
 #  Model management
 # ---------------------------------------------------------------------- #
@@ -76,12 +82,103 @@ def _resolve_model_path(model_type: str = "short_range") -> str:
     return model_path
 
 
+# ---------------------------------------------------------------------- #
+#  Detector pool
+# ---------------------------------------------------------------------- #
+# Creating a FaceDetector loads the TFLite graph and initialises the
+# interpreter, which costs more than a detection. Detectors are therefore
+# kept process-wide, keyed by (model_type, confidence, running mode), and
+# each one is guarded by its own lock because a detector is not safe to
+# call from several threads at once.
+_POOL_MAX_DETECTORS = 8
+_detector_pool: "OrderedDict[tuple, _PooledDetector]" = OrderedDict()
+_pool_lock = threading.Lock()
+
+
+class _PooledDetector:
+    """A FaceDetector plus the lock that serialises its use."""
+
+    def __init__(self, detector: FaceDetector):
+        self.detector = detector
+        self.lock = threading.Lock()
+        # VIDEO mode requires monotonically increasing timestamps for the
+        # lifetime of the detector, so each call continues this timeline.
+        self.next_timestamp_ms = 0
+
+    def close(self) -> None:
+        with self.lock:
+            try:
+                self.detector.close()
+            except Exception as e:
+                print(f"⚠️  MediaPipe_FaceCrop: Failed to close detector: {e}")
+
+
+def _get_detector(
+    model_type: str,
+    confidence_thresh: float,
+    running_mode: RunningMode = RunningMode.IMAGE,
+) -> _PooledDetector:
+    """Return a pooled detector, creating it on first use."""
+    key = (model_type, round(float(confidence_thresh), 4), running_mode)
+    evicted = []
+    with _pool_lock:
+        pooled = _detector_pool.get(key)
+        if pooled is not None:
+            _detector_pool.move_to_end(key)
+            return pooled
+
+        options = FaceDetectorOptions(
+            base_options=BaseOptions(model_asset_path=_resolve_model_path(model_type)),
+            running_mode=running_mode,
+            min_detection_confidence=confidence_thresh,
+        )
+        pooled = _PooledDetector(FaceDetector.create_from_options(options))
+        _detector_pool[key] = pooled
+        print(f"🔄 MediaPipe_FaceCrop: Created {model_type} detector (conf={key[1]}).")
+
+        while len(_detector_pool) > _POOL_MAX_DETECTORS:
+            evicted.append(_detector_pool.popitem(last=False)[1])
+
+    # Close outside the pool lock; close() waits for in-flight detections
+    for old in evicted:
+        old.close()
+    return pooled
+
+
+@atexit.register
+def _close_detectors() -> None:
+    with _pool_lock:
+        pooled = list(_detector_pool.values())
+        _detector_pool.clear()
+    for detector in pooled:
+        detector.close()
+
+
 # ---------------------------------------------------------------------- #
 #  Node class
 # ---------------------------------------------------------------------- #
 class MediaPipe_FaceCrop:
     """Detect and crop faces using Google MediaPipe Face Detection
-    (Tasks API). Now supports Full Range model for distant faces."""
+    (Tasks API). Now supports Full Range model for distant faces.
+
+    Every frame of the IMAGE batch is processed. ``running_mode`` "video"
+    feeds the batch to MediaPipe's VIDEO mode as a frame sequence with
+    timestamps derived from ``frame_rate``. For batches, crops are resized
+    to ``crop_size`` x ``crop_size`` and stacked into one IMAGE batch; a
+    single image keeps its native crop size. ``bboxes`` lists the crop box
+    of every frame (the whole frame where no face was found).
+
+    ``detect_long_side`` runs detection on a copy downscaled to that long
+    side (0 = full resolution) and maps the boxes back; ``refine_faces``
+    re-detects each face on a full-resolution window around it. Crops are
+    always taken from the original pixels.
+
+    ``faces`` / ``face_masks`` / ``face_bboxes`` return every detected face
+    of every frame from the same detection pass (frame order, largest face
+    first), letterboxed to ``crop_size`` x ``crop_size``; the masks are 0
+    over the letterbox padding. For batches ``face_bboxes`` holds one
+    ``[K, 4]`` tensor per frame so each face stays with its own frame.
+    """
 
     @classmethod
     def INPUT_TYPES(cls):
@@ -106,10 +203,29 @@ class MediaPipe_FaceCrop:
                     {"default": True},
                 ),
             },
+            "optional": {
+                "running_mode": (["image", "video"], {"default": "image"}),
+                "frame_rate": (
+                    "FLOAT",
+                    {"default": 24.0, "min": 1.0, "max": 240.0, "step": 1.0},
+                ),
+                "crop_size": (
+                    "INT",
+                    {"default": 512, "min": 64, "max": 4096, "step": 8},
+                ),
+                "detect_long_side": (
+                    "INT",
+                    {"default": 0, "min": 0, "max": 8192, "step": 64},
+                ),
+                "refine_faces": ("BOOLEAN", {"default": False}),
+            },
         }
 
-    RETURN_TYPES = ("IMAGE", "MASK", "INT", "INT", "INT", "INT")
-    RETURN_NAMES = ("cropped_image", "mask", "bbox_x", "bbox_y", "bbox_w", "bbox_h")
+    RETURN_TYPES = ("IMAGE", "MASK", "INT", "INT", "INT", "INT", "BBOX", "IMAGE", "MASK", "BBOX")
+    RETURN_NAMES = (
+        "cropped_image", "mask", "bbox_x", "bbox_y", "bbox_w", "bbox_h", "bboxes",
+        "faces", "face_masks", "face_bboxes",
+    )
     FUNCTION = "crop_face"
     CATEGORY = "Midnight Look/Face"
 
@@ -124,122 +240,165 @@ class MediaPipe_FaceCrop:
         face_index: int,
         confidence_thresh: float,
         force_square: bool,
+        running_mode: str = "image",
+        frame_rate: float = 24.0,
+        crop_size: int = 512,
+        detect_long_side: int = 0,
+        refine_faces: bool = False,
     ):
         # -------------------------------------------------------------- #
         # 1. Tensor -> Numpy
         # -------------------------------------------------------------- #
-        batch_size = image.shape[0]
-        if batch_size > 1:
-            print(
-                f"⚠️  MediaPipe_FaceCrop: batch size is {batch_size}, "
-                "processing only the first image."
-            )
-
-        img_np = (image[0].cpu().numpy() * 255).astype(np.uint8)
-        h, w, _ = img_np.shape
+        batch_size, h, w, _ = image.shape
+        imgs_np = (image.cpu().numpy() * 255).astype(np.uint8)
 
         # -------------------------------------------------------------- #
-        # 2. Run face detection
+        # 2. Run face detection on every frame
         # -------------------------------------------------------------- #
-        model_path = _resolve_model_path(model_type)
-
-        options = FaceDetectorOptions(
-            base_options=BaseOptions(model_asset_path=model_path),
-            running_mode=RunningMode.IMAGE,
-            min_detection_confidence=confidence_thresh,
+        all_detections = self._detect_frames(
+            imgs_np, model_type, confidence_thresh,
+            running_mode == "video", frame_rate,
+            detect_long_side, refine_faces,
         )
 
-        mp_image = mp.Image(
-            image_format=mp.ImageFormat.SRGB,
-            data=img_np,
-        )
-
-        with FaceDetector.create_from_options(options) as detector:
-            result = detector.detect(mp_image)
-
         # -------------------------------------------------------------- #
-        # 3. Handle no-detection
+        # 3.-7. Per-frame crop boxes
         # -------------------------------------------------------------- #
-        if not result.detections:
-            print(
-                f"⚠️  MediaPipe_FaceCrop ({model_type}): No face detected."
+        boxes = []
+        for i, detections in enumerate(all_detections):
+            if not detections:
+                print(
+                    f"⚠️  MediaPipe_FaceCrop ({model_type}): No face detected"
+                    f" in frame {i}."
+                )
+            idx = face_index if face_index < len(detections) else 0
+            boxes.append(
+                padded_crop_box(
+                    detections[idx], padding_factor, force_square, w, h
+                )
+                if detections
+                else None
             )
-            return self._passthrough(image, h, w)
-
-        # -------------------------------------------------------------- #
-        # 4. Sort & Select
-        # -------------------------------------------------------------- #
-        detections = sorted(
-            result.detections,
-            key=lambda d: d.bounding_box.width * d.bounding_box.height,
-            reverse=True,
+        bboxes = [
+            torch.tensor(box or (0, 0, w, h), dtype=torch.int64)
+            for box in boxes
+        ]
+
+        # All faces of all frames, from the same detections
+        face_crops = [
+            (i, box)
+            for i, detections in enumerate(all_detections)
+            for box in (
+                padded_crop_box(d, padding_factor, force_square, w, h)
+                for d in detections
+            )
+            if box is not None
+        ]
+        faces, face_masks = letterbox_crops(imgs_np, face_crops, crop_size)
+        all_faces = (
+            faces,
+            face_masks,
+            crop_bboxes(face_crops, batch_size),
         )
 
-        if face_index >= len(detections):
-            face_index = 0
-
-        bbox = detections[face_index].bounding_box
-
-        # Absolute coordinates
-        abs_x = float(bbox.origin_x)
-        abs_y = float(bbox.origin_y)
-        abs_w = float(bbox.width)
-        abs_h = float(bbox.height)
-
-        # -------------------------------------------------------------- #
-        # 5. Padding
-        # -------------------------------------------------------------- #
-        pad_w = abs_w * padding_factor
-        pad_h = abs_h * padding_factor
-
-        x1 = abs_x - pad_w / 2
-        y1 = abs_y - pad_h / 2
-        x2 = abs_x + abs_w + pad_w / 2
-        y2 = abs_y + abs_h + pad_h / 2
-
-        # -------------------------------------------------------------- #
-        # 6. Force Square
-        # -------------------------------------------------------------- #
-        if force_square:
-            cx = (x1 + x2) / 2
-            cy = (y1 + y2) / 2
-            side = max(x2 - x1, y2 - y1)
-            x1 = cx - side / 2
-            y1 = cy - side / 2
-            x2 = cx + side / 2
-            y2 = cy + side / 2
-
         # -------------------------------------------------------------- #
-        # 7. Clamp & Crop
+        # 8. Output
         # -------------------------------------------------------------- #
-        x1 = int(max(0, x1))
-        y1 = int(max(0, y1))
-        x2 = int(min(w, x2))
-        y2 = int(min(h, y2))
-
-        crop_w = x2 - x1
-        crop_h = y2 - y1
-
-        if crop_w <= 0 or crop_h <= 0:
-            return self._passthrough(image, h, w)
+        if batch_size == 1:
+            if boxes[0] is None:
+                return self._passthrough(image, h, w) + (bboxes,) + all_faces
+
+            x1, y1, x2, y2 = boxes[0]
+            cropped_tensor = (
+                torch.from_numpy(imgs_np[0, y1:y2, x1:x2, :].astype(np.float32) / 255.0)
+                .unsqueeze(0)
+            )
+            mask = torch.ones((1, y2 - y1, x2 - x1), dtype=torch.float32)
 
-        cropped_np = img_np[y1:y2, x1:x2, :]
+            print(
+                f"✅ MediaPipe_FaceCrop: Cropped face ({model_type}) at "
+                f"[x={x1}, y={y1}, w={x2 - x1}, h={y2 - y1}]"
+            )
+            return (cropped_tensor, mask, x1, y1, x2 - x1, y2 - y1, bboxes) + all_faces
 
-        # -------------------------------------------------------------- #
-        # 8. Output
-        # -------------------------------------------------------------- #
-        cropped_tensor = (
-            torch.from_numpy(cropped_np.astype(np.float32) / 255.0)
-            .unsqueeze(0)
-        )
-        mask = torch.ones((1, crop_h, crop_w), dtype=torch.float32)
+        # Batches: resize every crop to a common size so they stack
+        cropped_tensor = stack_crops(imgs_np, [box or (0, 0, w, h) for box in boxes], crop_size)
+        mask = torch.ones((batch_size, crop_size, crop_size), dtype=torch.float32)
+        x1, y1, x2, y2 = boxes[0] or (0, 0, w, h)
 
+        found = sum(box is not None for box in boxes)
         print(
-            f"✅ MediaPipe_FaceCrop: Cropped face ({model_type}) at "
-            f"[x={x1}, y={y1}, w={crop_w}, h={crop_h}]"
+            f"✅ MediaPipe_FaceCrop: Cropped faces ({model_type}, {running_mode}) "
+            f"in {found}/{batch_size} frame(s) at {crop_size}x{crop_size}"
         )
+        return (cropped_tensor, mask, x1, y1, x2 - x1, y2 - y1, bboxes) + all_faces
 
-        return (cropped_tensor, mask, x1, y1, crop_w, crop_h)
+    @staticmethod
+    def _detect_frames(
+        imgs_np: np.ndarray,
+        model_type: str,
+        confidence_thresh: float,
+        video: bool,
+        frame_rate: float,
+        detect_long_side: int = 0,
+        refine_faces: bool = False,
+    ) -> list:
+        """``(x, y, w, h, score)`` detections per frame, largest face first.
+
+        IMAGE-mode results go through the shared detection cache; VIDEO mode
+        always runs the detector so its frame timeline stays intact."""
+        mode = RunningMode.VIDEO if video else RunningMode.IMAGE
+        pooled = _get_detector(model_type, confidence_thresh, mode)
+        # Refinement windows are independent stills, even in VIDEO mode
+        refiner = _get_detector(model_type, confidence_thresh) if video and refine_faces else pooled
+        frame_ms = 1000.0 / frame_rate
+
+        def to_boxes(result):
+            return [
+                (
+                    d.bounding_box.origin_x,
+                    d.bounding_box.origin_y,
+                    d.bounding_box.width,
+                    d.bounding_box.height,
+                    d.categories[0].score if getattr(d, "categories", None) else 1.0,
+                )
+                for d in result.detections
+            ]
+
+        def detect_still(img_np):
+            mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=np.ascontiguousarray(img_np))
+            if refiner is pooled:
+                return to_boxes(pooled.detector.detect(mp_image))
+            with refiner.lock:
+                return to_boxes(refiner.detector.detect(mp_image))
+
+        all_detections = []
+        with pooled.lock:
+            start_ms = pooled.next_timestamp_ms
+            for i, img_np in enumerate(imgs_np):
+                if video:
+                    timestamp_ms = start_ms + int(round(i * frame_ms))
+                    pooled.next_timestamp_ms = timestamp_ms + max(1, int(round(frame_ms)))
+
+                    def detect_fn(frame_np, timestamp_ms=timestamp_ms):
+                        mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=np.ascontiguousarray(frame_np))
+                        return to_boxes(pooled.detector.detect_for_video(mp_image, timestamp_ms))
+
+                    boxes = detect_pyramid(
+                        img_np, detect_fn, detect_long_side, refine_faces,
+                        refine_fn=detect_still,
+                    )
+                else:
+                    boxes = cached_detections(
+                        "mediapipe",
+                        (model_type, confidence_thresh, detect_long_side, refine_faces),
+                        img_np,
+                        lambda frame: detect_pyramid(frame, detect_still, detect_long_side, refine_faces),
+                    )
+                all_detections.append(sorted(boxes, key=lambda b: b[2] * b[3], reverse=True))
+        if not video:
+            print(f"⚡ MediaPipe_FaceCrop: {stats_line()}")
+        return all_detections
 
     @staticmethod
     def _passthrough(image: torch.Tensor, h: int, w: int):
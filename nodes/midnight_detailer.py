@@ -1,10 +1,18 @@
 import torch
 import numpy as np
-import scipy.ndimage
 import comfy.utils
 import nodes
 import folder_paths
 import os
+import contextlib
+import functools
+import math
+import weakref
+
+from .cache import LRUCache, image_hash, tensor_nbytes
+from .detection_cache import detection_cache, detection_key
+from .mask_ops import refine_mask
+from .model_cache import aux_models
 
 def get_model_dir(folder_name):
     base = os.path.join(folder_paths.models_dir, folder_name)
@@ -30,13 +38,412 @@ dino_dir = get_model_dir("grounding-dino")
 if "grounding-dino" not in folder_paths.folder_names_and_paths:
     folder_paths.folder_names_and_paths["grounding-dino"] = ([dino_dir], folder_paths.supported_pt_extensions)
 
-_dino_cache = {}
-_sam2_cache = {}
+# Text conditionings for the detailer's guide/empty prompts, keyed by CLIP identity + patches + text
+_cond_cache = LRUCache("detailer conditioning", max_entries=32)
+
+
+def _clip_identity(clip):
+    """Cache key part for a CLIP object and its patches, or None if it can't be weak-referenced."""
+    try:
+        # A weakref key matches only the very same (still alive) CLIP object, so a new CLIP
+        # that happens to reuse a freed object's id() can never hit a stale entry.
+        clip_ref = weakref.ref(clip)
+    except TypeError:
+        return None
+    patcher = getattr(clip, "patcher", None)
+    return (clip_ref, getattr(patcher, "patches_uuid", None), getattr(clip, "layer_idx", None))
+
+
+def _encode_text_cached(clip, text):
+    """CLIPTextEncode with an LRU cache so repeated detailer runs skip text encoding."""
+    from nodes import CLIPTextEncode
+
+    clip_key = _clip_identity(clip)
+    if clip_key is None:
+        return CLIPTextEncode().encode(clip, text)[0]
+    key = clip_key + (text,)
+
+    cond = _cond_cache.get(key)
+    if cond is None:
+        cond = _cond_cache.put(key, CLIPTextEncode().encode(clip, text)[0])
+    return cond
+
+
+# Decoded detailer buckets keyed by everything that affects sampling (but not blending)
+_sample_cache = LRUCache(
+    "detailer samples",
+    max_bytes=int(os.environ.get("MIDNIGHTLOOK_DETAILER_SAMPLE_CACHE_MB", "512")) * 1024 * 1024,
+    size_fn=tensor_nbytes,
+)
+
+
+_PRECISION_DTYPES = {"fp16": torch.float16, "bf16": torch.bfloat16}
+
+
+def _resolve_inference_mode(device, precision):
+    """
+    Maps the node's ``device`` / ``precision`` choices to ``(device, autocast dtype or None)``.
+    Unsupported combinations are downgraded with a warning instead of failing.
+    """
+    if device == "auto":
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    elif device == "cuda" and not torch.cuda.is_available():
+        print("⚠️ SAM2Loader: CUDA requested but not available. Running on CPU.")
+        device = "cpu"
+
+    if device == "cpu" and precision == "fp16":
+        # CPU autocast kernels are tuned for bfloat16; fp16 is slow or unsupported there
+        print("⚠️ SAM2Loader: fp16 is not supported on CPU. Using bf16 instead.")
+        precision = "bf16"
+    elif device == "cuda" and precision == "bf16" and not torch.cuda.is_bf16_supported():
+        print("⚠️ SAM2Loader: This GPU does not support bf16. Using fp16 instead.")
+        precision = "fp16"
+
+    return device, _PRECISION_DTYPES.get(precision)
+
+
+def _autocast(device, dtype):
+    if dtype is None:
+        return contextlib.nullcontext()
+    return torch.autocast(device_type=device, dtype=dtype)
+
+
+@contextlib.contextmanager
+def _cpu_threads(num_threads):
+    """Temporarily sets torch's intra-op CPU thread count (0 keeps the current setting)."""
+    previous = torch.get_num_threads()
+    if num_threads > 0:
+        torch.set_num_threads(num_threads)
+    try:
+        yield
+    finally:
+        if num_threads > 0:
+            torch.set_num_threads(previous)
+
+
+def _resolve_dino_path(dino_model_dir):
+    """Resolves the GroundingDINO model directory the same way for every caller."""
+    dino_model_dir = dino_model_dir.strip()
+    
+    # Robust Path Resolution
+    dino_path = None
+    
+    # 1. Check if it's an absolute path
+    if os.path.isabs(dino_model_dir) and os.path.exists(dino_model_dir):
+        dino_path = dino_model_dir
+    # 2. Check if it's relative to ComfyUI base path
+    elif os.path.exists(os.path.join(folder_paths.base_path, dino_model_dir)):
+        dino_path = os.path.join(folder_paths.base_path, dino_model_dir)
+    else:
+        # 3. Search inside ComfyUI's registered grounding-dino folders
+        clean_name = dino_model_dir.replace(" ", "") # Fix accidental spaces
+        for search_dir in folder_paths.get_folder_paths("grounding-dino"):
+            # Check if the folder itself contains config.json (user placed files directly in models/grounding-dino)
+            if os.path.exists(os.path.join(search_dir, "config.json")):
+                dino_path = search_dir
+                break
+            # Check if the input is a subfolder
+            elif os.path.exists(os.path.join(search_dir, dino_model_dir)):
+                dino_path = os.path.join(search_dir, dino_model_dir)
+                break
+            # Check if the input is a file name inside the folder
+            elif os.path.exists(os.path.join(search_dir, clean_name)):
+                dino_path = os.path.join(search_dir, clean_name)
+                break
+
+    # Fallback if nothing found
+    if not dino_path:
+         dino_path = dino_model_dir
+         
+    # If the user accidentally points directly to the model file, use its parent directory instead
+    if os.path.isfile(dino_path):
+         dino_path = os.path.dirname(dino_path)
+
+    return dino_path
+
+
+def _load_dino(dino_path, device):
+    """Returns a cached ``(processor, model)`` pair, or None if loading failed."""
+    from transformers import AutoProcessor, AutoModelForZeroShotObjectDetection
+
+    cached = aux_models.get(("grounding-dino", dino_path), device)
+    if cached is not None:
+        print(f"⚡ SAM2Loader: Using cached GroundingDINO from {dino_path}")
+        return cached
+
+    print(f"🔄 SAM2Loader: Loading GroundingDINO locally from {dino_path}")
+    try:
+        processor = AutoProcessor.from_pretrained(dino_path, local_files_only=True, use_fast=False)
+        dino_model = AutoModelForZeroShotObjectDetection.from_pretrained(dino_path, local_files_only=True)
+        # The cache moves the weights to the device once it has made room for them
+        return aux_models.put(("grounding-dino", dino_path), (processor, dino_model), dino_model, device)
+    except Exception as e:
+        print(f"⚠️ SAM2Loader Error loading transformers GroundingDINO: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+
+def _run_dino(processor, dino_model, pil_images, prompt, box_threshold, text_threshold, device, dtype=None):
+    """
+    Runs a single GroundingDINO forward over a list of same-sized PIL images.
+    Returns one ``{"boxes", "scores", "labels"}`` dict per image, filtered by ``box_threshold``.
+    ``dtype`` enables autocast for the forward; post-processing always runs in fp32.
+    """
+    inputs = processor(images=pil_images, text=[prompt] * len(pil_images), return_tensors="pt").to(device)
+    with torch.no_grad(), _autocast(device, dtype):
+        outputs = dino_model(**inputs)
+    outputs.logits = outputs.logits.float()
+    outputs.pred_boxes = outputs.pred_boxes.float()
+
+    # In ComfyUI, inputs like box_threshold might come in as primitive types/strings
+    bt = float(box_threshold)
+    tt = float(text_threshold)
+
+    print(f"DEBUG: Applying GroundingDINO thresholds - Box: {bt}, Text: {tt}")
+    
+    # Print the literal max score from the logits to see what the model is predicting
+    max_score = outputs.logits.sigmoid().max().item()
+    print(f"DEBUG: Max DINO Logit Sigmoid Score in the entire batch is: {max_score:.4f}")
+
+    target_sizes = [img.size[::-1] for img in pil_images] # (height, width)
+
+    # Workaround for HuggingFace Transformers version differences on keyword arguments
+    try:
+        results = processor.post_process_grounded_object_detection(
+            outputs,
+            inputs.input_ids,
+            box_threshold=bt,
+            text_threshold=tt,
+            target_sizes=target_sizes
+        )
+    except Exception as inner_e:
+        print(f"⚠️ Warning: post_process with thresholds failed ({inner_e}). Falling back to manual logit filtering.")
+        # transformers 4.40+ hardcodes the threshold filter inside post_process if not provided,
+        # so we force a very low threshold through the class attributes and filter manually below.
+        if hasattr(processor, "box_threshold"):
+            processor.box_threshold = 0.001
+        if hasattr(processor, "text_threshold"):
+            processor.text_threshold = 0.001
+            
+        results = processor.post_process_grounded_object_detection(
+            outputs,
+            target_sizes=target_sizes
+        )
+
+    filtered = []
+    for result in results:
+        boxes = result["boxes"]
+        scores = result["scores"]
+        labels = result.get("text_labels", result.get("labels", [""] * len(scores)))
+
+        print(f"DEBUG: Found {len(scores)} total objects before filtering.")
+        if len(scores) > 0:
+             print(f"DEBUG: Max score is {scores.max().item():.4f}, threshold is {bt}")
+
+        # Apply manual threshold filtering using PyTorch indexing
+        valid_indices = scores > bt
+        filtered.append({
+            "boxes": boxes[valid_indices],
+            "scores": scores[valid_indices],
+            "labels": [label for label, keep in zip(labels, valid_indices.tolist()) if keep],
+        })
+        print(f"DEBUG: {int(valid_indices.sum().item())} objects remained after thresholding.")
+
+    return filtered
+
+
+def _run_dino_cached(dino_path, processor, dino_model, imgs_np, prompt, box_threshold, text_threshold, device, dtype=None):
+    """
+    ``_run_dino`` over uint8 ``imgs_np`` frames through the shared detection cache: frames
+    already detected with the same model/prompt/thresholds/precision are answered from the
+    cache and only the rest go through one GroundingDINO forward. Results live on the CPU.
+    """
+    from PIL import Image
+
+    params = (dino_path, prompt, float(box_threshold), float(text_threshold), torch.device(device).type, str(dtype))
+    keys = [detection_key("grounding-dino", params, img_np) for img_np in imgs_np]
+    detections = [detection_cache.get(key) for key in keys]
+
+    missing = [j for j, det in enumerate(detections) if det is None]
+    if missing:
+        pil_images = [Image.fromarray(imgs_np[j]) for j in missing]
+        for j, det in zip(missing, _run_dino(processor, dino_model, pil_images, prompt, box_threshold, text_threshold, device, dtype)):
+            det = {"boxes": det["boxes"].cpu(), "scores": det["scores"].cpu(), "labels": tuple(det["labels"])}
+            detections[j] = detection_cache.put(keys[j], det)
+    print(f"⚡ SAM2Loader: {detection_cache.stats_line()}")
+    return detections
+
+
+def _resolve_sam_path(sam2_model_name):
+    """Returns ``(sam_path, sam2_model_name)``; ``sam_path`` is None if the checkpoint is missing."""
+    sam_path = folder_paths.get_full_path("sams", sam2_model_name)
+    if hasattr(folder_paths, "get_folder_paths"):
+        if sam_path is None:
+           sam_paths = folder_paths.get_folder_paths("sam")
+           if sam_paths:
+               for fp in sam_paths:
+                   test_path = os.path.join(fp, sam2_model_name)
+                   if os.path.exists(test_path):
+                       sam_path = test_path
+                       break
+    
+    if sam_path is None:
+         sam_dir_resolved = get_model_dir("sam")
+         sams_dir_resolved = get_model_dir("sams")
+         test_path = os.path.join(sam_dir_resolved, "model.safetensors")
+         if os.path.exists(test_path):
+             sam_path = test_path
+             sam2_model_name = "model.safetensors"
+         else:
+             test_path = os.path.join(sams_dir_resolved, sam2_model_name)
+             if os.path.exists(test_path):
+                 sam_path = test_path
+
+    if not sam_path or not os.path.exists(sam_path):
+        return None, sam2_model_name
+    return sam_path, sam2_model_name
+
+
+def _sam2_config_for(sam2_model_name):
+    if "large" in sam2_model_name:
+        return "sam2_hiera_l.yaml"
+    elif "base_plus" in sam2_model_name:
+        return "sam2_hiera_b+.yaml"
+    elif "small" in sam2_model_name:
+        return "sam2_hiera_s.yaml"
+    elif "tiny" in sam2_model_name:
+        return "sam2_hiera_t.yaml"
+    return "sam2_hiera_l.yaml"
+
+
+def _build_sam2_model(build_fn, model_cfg, sam_path, device):
+    """Calls a SAM2 ``build_*`` function with torch.load patched for safetensors checkpoints."""
+    # PyTorch 2.6+ defaults to weights_only=True which breaks SAM2 safetensors unpickling
+    # Also, SAM2 repository hardcodes torch.load() which doesn't support .safetensors out of the box.
+    original_load = torch.load
+    def safe_load(f, *args, **kwargs):
+        if isinstance(f, str) and f.endswith(".safetensors"):
+            sd = comfy.utils.load_torch_file(f)
+            # If it's a flat state dict, wrap it for SAM2's unpickler
+            if "model" not in sd:
+                return {"model": sd}
+            return sd
+        # Fallback to normal torch load for .pt files but disable weights_only to prevent Unpickler errors
+        kwargs['weights_only'] = False
+        return original_load(f, *args, **kwargs)
+    
+    torch.load = safe_load
+    try:
+        return build_fn(model_cfg, sam_path, device=device)
+    finally:
+        torch.load = original_load
+
+
+def _load_sam2(sam_path, sam2_model_name, device):
+    """Returns a cached ``SAM2ImagePredictor``, or None if building failed."""
+    from sam2.build_sam import build_sam2
+    from sam2.sam2_image_predictor import SAM2ImagePredictor
+
+    cached = aux_models.get(("sam2", sam_path), device)
+    if cached is not None:
+         print(f"⚡ SAM2Loader: Using cached SAM2 from {sam_path}")
+         return cached
+
+    print(f"🔄 SAM2Loader: Loading SAM2 from {sam_path}")
+    try:
+         # Built on CPU; the cache moves the weights to the device once it has made room for them
+         sam2_model = _build_sam2_model(build_sam2, _sam2_config_for(sam2_model_name), sam_path, "cpu")
+         predictor = SAM2ImagePredictor(sam2_model)
+         return aux_models.put(("sam2", sam_path), predictor, sam2_model, device)
+    except Exception as e:
+         print(f"⚠️ SAM2Loader Error building SAM2: {e}")
+         import traceback
+         traceback.print_exc()
+         return None
+
+
+def _reflect_indices(start, stop, size, device):
+    """Index map for ``range(start, stop)`` with numpy ``reflect`` padding outside ``[0, size)``."""
+    idx = torch.arange(start, stop, device=device)
+    if size == 1:
+        return torch.zeros_like(idx)
+    period = 2 * (size - 1)
+    idx = torch.remainder(idx, period)
+    return torch.where(idx >= size, period - idx, idx)
+
+
+# SAM2 image-encoder features keyed by (checkpoint, precision, image content), kept on the CPU under a byte budget
+_sam2_embedding_cache = LRUCache(
+    "SAM2 image embeddings",
+    max_bytes=int(os.environ.get("MIDNIGHTLOOK_SAM2_EMBED_CACHE_MB", "1024")) * 1024 * 1024,
+    size_fn=tensor_nbytes,
+)
+
+
+def _set_images_cached(predictor, sam_path, images, precision="fp32"):
+    """
+    ``predictor.set_image_batch(images)`` that only runs the Hiera image encoder for images
+    whose features are not cached yet, so re-prompting the same pixels just runs the mask decoder.
+    """
+    keys = [(sam_path, precision, image_hash(img)) for img in images]
+    entries = [_sam2_embedding_cache.get(key) for key in keys]
+    missing = [j for j, entry in enumerate(entries) if entry is None]
+
+    if missing:
+        predictor.set_image_batch([images[j] for j in missing])
+        feats = predictor._features
+        for n, j in enumerate(missing):
+            entries[j] = _sam2_embedding_cache.put(keys[j], {
+                "image_embed": feats["image_embed"][n:n + 1].detach().cpu(),
+                "high_res_feats": [feat[n:n + 1].detach().cpu() for feat in feats["high_res_feats"]],
+                "orig_hw": predictor._orig_hw[n],
+            })
+
+    print(f"⚡ SAM2Loader: {_sam2_embedding_cache.stats_line()}")
+    if len(missing) == len(images):
+        # The predictor already holds exactly these features in this order
+        return
+
+    device = predictor.device
+    predictor.reset_predictor()
+    predictor._features = {
+        "image_embed": torch.cat([entry["image_embed"] for entry in entries]).to(device),
+        "high_res_feats": [
+            torch.cat([entry["high_res_feats"][level] for entry in entries]).to(device)
+            for level in range(len(entries[0]["high_res_feats"]))
+        ],
+    }
+    predictor._orig_hw = [entry["orig_hw"] for entry in entries]
+    predictor._is_image_set = True
+    predictor._is_batch = True
+
+
+def _mask_to_float(mask_np):
+    # If it's already a float logit, we need a threshold > 0.0
+    # If it's boolean, we convert it.
+    if mask_np.dtype == np.bool_:
+         return mask_np.astype(np.float32)
+    return (mask_np > 0.0).astype(np.float32)
+
 
 class SAM2LoaderNode:
     """
     Loads a SAM2 model from `models/sams` and performs text-prompted or center-focused segmentation.
     Outputs a bounding box and a mask.
+    Every image of the IMAGE batch is processed: GroundingDINO and SAM2 each run once over the
+    whole batch, and the BBOX list / MASK batch stay aligned with the batch index.
+
+    detection_mode "best" keeps the highest scoring box per image. "all" keeps every box above
+    the thresholds for every phrase of the prompt (e.g. "face. hand. eye."), segments them in one
+    batched SAM2 call and returns one instance mask per box:
+      * single image: BBOX list with one [4] entry per box, MASK batch [K, H, W]
+      * image batch:  BBOX list with one [K_i, 4] entry per image, MASK batch [sum K_i, H, W]
+    The labels output lists the matched phrase of every box, one per line, in the same order.
+
+    device / precision choose where and how DINO and SAM2 run: "cpu" keeps them off a GPU that is
+    busy sampling, and fp16/bf16 run the forwards under autocast (fp16 on CPU falls back to bf16).
+    cpu_threads limits torch's CPU thread pool while running on CPU.
     """
     @classmethod
     def INPUT_TYPES(cls):
@@ -52,300 +459,463 @@ class SAM2LoaderNode:
                 "dino_model_dir": ("STRING", {"multiline": False, "default": "models/grounding-dino/grounding-dino-base"}),
                 "box_threshold": ("FLOAT", {"default": 0.3, "min": 0.0, "max": 1.0, "step": 0.01}),
                 "text_threshold": ("FLOAT", {"default": 0.25, "min": 0.0, "max": 1.0, "step": 0.01}),
+            },
+            "optional": {
+                "detection_mode": (["best", "all"], {"default": "best"}),
+                "device": (["auto", "cuda", "cpu"], {"default": "auto"}),
+                "precision": (["fp32", "fp16", "bf16"], {"default": "fp32"}),
+                "cpu_threads": ("INT", {"default": 0, "min": 0, "max": 256, "tooltip": "Torch CPU threads while running on CPU (0 = unchanged)"}),
             }
         }
 
-    RETURN_TYPES = ("BBOX", "MASK")
-    RETURN_NAMES = ("bbox", "mask")
+    RETURN_TYPES = ("BBOX", "MASK", "STRING")
+    RETURN_NAMES = ("bbox", "mask", "labels")
     FUNCTION = "process"
     CATEGORY = "MidnightLook/Detailer"
 
-    def process(self, image, prompt, sam2_model_name, dino_model_dir, box_threshold, text_threshold):
-        global _dino_cache, _sam2_cache
-        import folder_paths
-        import os
-        from sam2.build_sam import build_sam2
-        from sam2.sam2_image_predictor import SAM2ImagePredictor
+    @staticmethod
+    def _fallback(b, h, w):
+        # Fallback BBOX is the whole image so the pipeline doesn't violently break
+        return ([torch.tensor([0, 0, w, h], dtype=torch.int64) for _ in range(b)], torch.zeros((b, h, w), dtype=torch.float32), "")
 
+    def process(self, image, prompt, sam2_model_name, dino_model_dir, box_threshold, text_threshold, detection_mode="best",
+                device="auto", precision="fp32", cpu_threads=0):
+        device, dtype = _resolve_inference_mode(device, precision)
+        precision = {torch.float16: "fp16", torch.bfloat16: "bf16"}.get(dtype, "fp32")
+        print(f"DEBUG: SAM2Loader running on {device} ({precision})")
+        with _cpu_threads(cpu_threads if device == "cpu" else 0):
+            return self._process(image, prompt, sam2_model_name, dino_model_dir, box_threshold, text_threshold,
+                                 detection_mode, device, dtype, precision)
+
+    def _process(self, image, prompt, sam2_model_name, dino_model_dir, box_threshold, text_threshold,
+                 detection_mode, device, dtype, precision):
         # image shape: [B, H, W, C]
         b, h, w, c = image.shape
-        img_np = (image[0].cpu().numpy() * 255).astype(np.uint8)
+        imgs_np = (image.cpu().numpy() * 255).astype(np.uint8)
         
         # 1. Load GroundingDINO Model via Transformers
         try:
-            from transformers import AutoProcessor, AutoModelForZeroShotObjectDetection
+            import transformers  # noqa: F401
         except ImportError:
             print("⚠️ SAM2Loader: transformers library not found. Returning empty mask.")
-            return ([torch.tensor([0, 0, w, h], dtype=torch.int64)], torch.zeros((1, h, w), dtype=torch.float32))
+            return self._fallback(b, h, w)
 
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        dino_model_dir = dino_model_dir.strip()
-        
-        # Robust Path Resolution
-        dino_path = None
-        
-        # 1. Check if it's an absolute path
-        if os.path.isabs(dino_model_dir) and os.path.exists(dino_model_dir):
-            dino_path = dino_model_dir
-        # 2. Check if it's relative to ComfyUI base path
-        elif os.path.exists(os.path.join(folder_paths.base_path, dino_model_dir)):
-            dino_path = os.path.join(folder_paths.base_path, dino_model_dir)
-        else:
-            # 3. Search inside ComfyUI's registered grounding-dino folders
-            clean_name = dino_model_dir.replace(" ", "") # Fix accidental spaces
-            for search_dir in folder_paths.get_folder_paths("grounding-dino"):
-                # Check if the folder itself contains config.json (user placed files directly in models/grounding-dino)
-                if os.path.exists(os.path.join(search_dir, "config.json")):
-                    dino_path = search_dir
-                    break
-                # Check if the input is a subfolder
-                elif os.path.exists(os.path.join(search_dir, dino_model_dir)):
-                    dino_path = os.path.join(search_dir, dino_model_dir)
-                    break
-                # Check if the input is a file name inside the folder
-                elif os.path.exists(os.path.join(search_dir, clean_name)):
-                    dino_path = os.path.join(search_dir, clean_name)
-                    break
-
-        # Fallback if nothing found
-        if not dino_path:
-             dino_path = dino_model_dir
-             
-        # If the user accidentally points directly to the model file, use its parent directory instead
-        if os.path.isfile(dino_path):
-             dino_path = os.path.dirname(dino_path)
+        dino_path = _resolve_dino_path(dino_model_dir)
              
         if not os.path.exists(dino_path):
              print(f"⚠️ SAM2Loader: GroundingDINO directory not found at '{dino_path}'")
-             return ([torch.tensor([0, 0, w, h], dtype=torch.int64)], torch.zeros((1, h, w), dtype=torch.float32))
-        
-        if dino_path in _dino_cache:
-            processor, dino_model = _dino_cache[dino_path]
-            print(f"⚡ SAM2Loader: Using cached GroundingDINO from {dino_path}")
-        else:
-            print(f"🔄 SAM2Loader: Loading GroundingDINO locally from {dino_path}")
-            try:
-                processor = AutoProcessor.from_pretrained(dino_path, local_files_only=True, use_fast=False)
-                dino_model = AutoModelForZeroShotObjectDetection.from_pretrained(dino_path, local_files_only=True).to(device)
-                _dino_cache[dino_path] = (processor, dino_model)
-            except Exception as e:
-                print(f"⚠️ SAM2Loader Error loading transformers GroundingDINO: {e}")
-                import traceback
-                traceback.print_exc()
-                return ([torch.tensor([0, 0, w, h], dtype=torch.int64)], torch.zeros((1, h, w), dtype=torch.float32))
-
-        # 2. Predict BBox with GroundingDINO
-        from PIL import Image
-        pil_image = Image.fromarray(img_np)
+             return self._fallback(b, h, w)
         
+        dino = _load_dino(dino_path, device)
+        if dino is None:
+            return self._fallback(b, h, w)
+        processor, dino_model = dino
+
+        # 2. Predict BBoxes with GroundingDINO (one forward for the uncached frames)
         prompt = prompt.lower().strip()
         if not prompt.endswith("."):
             prompt = prompt + "."
             
-        print(f"DEBUG: Processing DINO Prompt: '{prompt}'")
+        print(f"DEBUG: Processing DINO Prompt: '{prompt}' for {b} image(s)")
             
         try:
-            inputs = processor(images=pil_image, text=prompt, return_tensors="pt").to(device)
-            with torch.no_grad():
-                outputs = dino_model(**inputs)
+            detections = _run_dino_cached(dino_path, processor, dino_model, imgs_np, prompt, box_threshold, text_threshold, device, dtype)
+        except Exception as e:
+            print(f"⚠️ SAM2Loader DINO Inference Error: {e}")
+            import traceback
+            traceback.print_exc()
+            return self._fallback(b, h, w)
 
-            # In ComfyUI, inputs like box_threshold might come in as primitive types/strings
-            bt = float(box_threshold)
-            tt = float(text_threshold)
+        # Per image: clamped boxes (highest score first) and their phrase labels
+        selected = []
+        for i, det in enumerate(detections):
+            if len(det["boxes"]) == 0:
+                print(f"⚠️ SAM2Loader: GroundingDINO found no objects for prompt '{prompt}' in image {i} above box_threshold {box_threshold}")
+                selected.append(([], []))
+                continue
 
-            print(f"DEBUG: Applying GroundingDINO thresholds - Box: {bt}, Text: {tt}")
-            
-            # Print the literal max score from the logits to see what the model is predicting
-            max_score = outputs.logits.sigmoid().max().item()
-            print(f"DEBUG: Max DINO Logit Sigmoid Score in the entire image is: {max_score:.4f}")
-
-            # Workaround for HuggingFace Transformers version differences on keyword arguments
-            try:
-                results = processor.post_process_grounded_object_detection(
-                    outputs,
-                    inputs.input_ids,
-                    box_threshold=bt,
-                    text_threshold=tt,
-                    target_sizes=[pil_image.size[::-1]] # (height, width)
-                )[0]
-            except Exception as inner_e:
-                print(f"⚠️ Warning: post_process with thresholds failed ({inner_e}). Falling back to manual logit filtering.")
-                # Since processor rejects the keywords, we might need to change it on the fly or just accept the defaults, 
-                # but transformers 4.40+ hardcodes the threshold filter inside post_process if not provided.
-                
-                # We will manually threshold the raw logits before calling post process
-                # Find valid logits that exceed our threshold
-                logits = outputs.logits.sigmoid()
+            order = det["scores"].argsort(descending=True).tolist()
+            if detection_mode != "all":
+                order = order[:1]
+
+            boxes, labels = [], []
+            for j in order:
+                x1, y1, x2, y2 = [int(v.item()) for v in det["boxes"][j]] # [xmin, ymin, xmax, ymax]
                 
-                # By passing a very low threshold we force post_process to keep the results.
-                # Unfortunately post_process doesn't let us pass it, so we mock the pre-processor logic or set the class attribute
-                if hasattr(processor, "box_threshold"):
-                    processor.box_threshold = 0.001
-                if hasattr(processor, "text_threshold"):
-                    processor.text_threshold = 0.001
+                # Clamp bounds
+                x1, y1 = max(0, x1), max(0, y1)
+                x2, y2 = min(w, x2), min(h, y2)
+                if x2 <= x1 or y2 <= y1:
+                    continue
+                boxes.append([x1, y1, x2, y2])
+                labels.append(str(det["labels"][j]) if j < len(det["labels"]) else "")
+
+            selected.append((boxes, labels))
+            print(f"✅ SAM2Loader DINO BBox(es) for '{prompt}' (image {i}): {list(zip(labels, boxes))}")
+
+        found = [i for i, (boxes, _) in enumerate(selected) if boxes]
+        instance_masks = {i: np.zeros((len(selected[i][0]), h, w), dtype=np.float32) for i in found}
+
+        # 3. Load SAM2 Model and 4. Predict every box of every image in one batched call
+        if found:
+            sam_path, sam2_model_name = _resolve_sam_path(sam2_model_name)
+            predictor = None
+            if sam_path is None:
+                print(f"⚠️ SAM2Loader: Could not find model {sam2_model_name}")
+            else:
+                predictor = _load_sam2(sam_path, sam2_model_name, device)
+
+            if predictor is not None:
+                try:
+                    with torch.no_grad(), _autocast(device, dtype):
+                        _set_images_cached(predictor, sam_path, [imgs_np[i] for i in found], precision)
+                        masks_batch, _, _ = predictor.predict_batch(
+                            box_batch=[np.array(selected[i][0]) for i in found],
+                            multimask_output=False,
+                        )
                     
-                results = processor.post_process_grounded_object_detection(
-                    outputs,
-                    target_sizes=[pil_image.size[::-1]]
-                )[0]
-                
-            # GroundingDINO outputs a batch of results. We only sent 1 image.
-            boxes = results["boxes"]
-            scores = results["scores"]
-            
+                    # SAM2 squeezes the box dimension away for a single box, so restore [K, H, W]
+                    for i, masks in zip(found, masks_batch):
+                        masks = np.asarray(masks).reshape(len(selected[i][0]), -1, h, w)[:, 0]
+                        instance_masks[i] = _mask_to_float(masks)
+
+                except Exception as e:
+                    print(f"⚠️ SAM2Loader Prediction Error: {e}")
+
+                print(f"✅ SAM2Loader: Generated SAM2 masks from DINO BBoxes for {len(found)}/{b} image(s).")
+
+        return self._build_outputs(selected, instance_masks, detection_mode, b, h, w)
+
+    def _build_outputs(self, selected, instance_masks, detection_mode, b, h, w):
+        labels_text = "\n".join(label for _, labels in selected for label in labels)
+
+        if detection_mode == "all":
+            if not instance_masks:
+                return self._fallback(b, h, w)
+            if b == 1:
+                bbox_list = [torch.tensor(box, dtype=torch.int64) for box in selected[0][0]]
+            else:
+                bbox_list = [torch.tensor(boxes, dtype=torch.int64).reshape(-1, 4) for boxes, _ in selected]
+            out_mask = torch.from_numpy(np.concatenate([instance_masks[i] for i in sorted(instance_masks)], axis=0))
+            print(f"DEBUG: Processed Mask shape: {out_mask.shape}")
+            return (bbox_list, out_mask, labels_text)
+
+        bbox_list, out_mask, _ = self._fallback(b, h, w)
+        for i in instance_masks:
+            bbox_list[i] = torch.tensor(selected[i][0][0], dtype=torch.int64)
+            out_mask[i] = torch.from_numpy(instance_masks[i][0])
+        print(f"DEBUG: Processed Mask shape: {out_mask.shape}, min: {out_mask.min()}, max: {out_mask.max()}")
+        return (bbox_list, out_mask, labels_text)
+
+
+
+def _box_iou(a, b):
+    ix1, iy1, ix2, iy2 = max(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, ix2 - ix1) * max(0, iy2 - iy1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def _load_sam2_video(sam_path, sam2_model_name, device):
+    """Returns a cached ``SAM2VideoPredictor``, or None if building failed."""
+    from sam2.build_sam import build_sam2_video_predictor
+
+    cached = aux_models.get(("sam2-video", sam_path), device)
+    if cached is not None:
+         print(f"⚡ SAM2VideoLoader: Using cached SAM2 video predictor from {sam_path}")
+         return cached
+
+    print(f"🔄 SAM2VideoLoader: Loading SAM2 video predictor from {sam_path}")
+    try:
+         predictor = _build_sam2_model(build_sam2_video_predictor, _sam2_config_for(sam2_model_name), sam_path, "cpu")
+         return aux_models.put(("sam2-video", sam_path), predictor, predictor, device)
+    except Exception as e:
+         print(f"⚠️ SAM2VideoLoader Error building SAM2 video predictor: {e}")
+         import traceback
+         traceback.print_exc()
+         return None
+
+
+class SAM2VideoLoaderNode:
+    """
+    Segments an IMAGE batch as a frame sequence with SAM2's video predictor.
+    GroundingDINO only runs on keyframes (every ``keyframe_interval`` frames, 0 = first frame only);
+    its boxes prompt the video predictor, and masks are propagated through the remaining frames with
+    SAM2's memory attention instead of a full detect + segment per frame.
+
+    The first keyframe with detections defines up to ``max_objects`` tracked objects. Later keyframes
+    re-prompt each object with the detection that best overlaps its previous box (IoU >= 0.3).
+    Outputs one BBOX per frame (bounds of the frame's mask, whole frame if empty) and a MASK batch
+    [B, H, W] with the union of all tracked objects per frame.
+    """
+    DINO_CHUNK = 8
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        sam_models = folder_paths.get_filename_list("sams")
+        if not sam_models:
+             sam_models = ["sam2_hiera_large.pt", "model.safetensors"]
+
+        return {
+            "required": {
+                "image": ("IMAGE",),
+                "prompt": ("STRING", {"multiline": False, "default": "face"}),
+                "sam2_model_name": (sam_models, ),
+                "dino_model_dir": ("STRING", {"multiline": False, "default": "models/grounding-dino/grounding-dino-base"}),
+                "box_threshold": ("FLOAT", {"default": 0.3, "min": 0.0, "max": 1.0, "step": 0.01}),
+                "text_threshold": ("FLOAT", {"default": 0.25, "min": 0.0, "max": 1.0, "step": 0.01}),
+                "keyframe_interval": ("INT", {"default": 16, "min": 0, "max": 4096}),
+                "max_objects": ("INT", {"default": 1, "min": 1, "max": 32}),
+            },
+            "optional": {
+                "device": (["auto", "cuda", "cpu"], {"default": "auto"}),
+                "precision": (["fp32", "fp16", "bf16"], {"default": "fp32"}),
+                "cpu_threads": ("INT", {"default": 0, "min": 0, "max": 256, "tooltip": "Torch CPU threads while running on CPU (0 = unchanged)"}),
+                "offload_frames_to_cpu": ("BOOLEAN", {"default": False}),
+            }
+        }
+
+    RETURN_TYPES = ("BBOX", "MASK")
+    RETURN_NAMES = ("bbox", "mask")
+    FUNCTION = "process"
+    CATEGORY = "MidnightLook/Detailer"
+
+    def process(self, image, prompt, sam2_model_name, dino_model_dir, box_threshold, text_threshold,
+                keyframe_interval, max_objects, device="auto", precision="fp32", cpu_threads=0, offload_frames_to_cpu=False):
+        device, dtype = _resolve_inference_mode(device, precision)
+        with _cpu_threads(cpu_threads if device == "cpu" else 0):
+            return self._process(image, prompt, sam2_model_name, dino_model_dir, box_threshold, text_threshold,
+                                 keyframe_interval, max_objects, device, dtype, offload_frames_to_cpu)
+
+    def _process(self, image, prompt, sam2_model_name, dino_model_dir, box_threshold, text_threshold,
+                 keyframe_interval, max_objects, device, dtype, offload_frames_to_cpu):
+        b, h, w, c = image.shape
+        imgs_np = (image.cpu().numpy() * 255).astype(np.uint8)
+        fallback = SAM2LoaderNode._fallback(b, h, w)[:2]
+
+        try:
+            import transformers  # noqa: F401
+        except ImportError:
+            print("⚠️ SAM2VideoLoader: transformers library not found. Returning empty mask.")
+            return fallback
+
+        dino_path = _resolve_dino_path(dino_model_dir)
+        if not os.path.exists(dino_path):
+             print(f"⚠️ SAM2VideoLoader: GroundingDINO directory not found at '{dino_path}'")
+             return fallback
+        dino = _load_dino(dino_path, device)
+        if dino is None:
+            return fallback
+
+        prompt = prompt.lower().strip()
+        if not prompt.endswith("."):
+            prompt = prompt + "."
+
+        # 1. GroundingDINO on keyframes only
+        keyframes = list(range(0, b, keyframe_interval)) if keyframe_interval > 0 else [0]
+        try:
+            prompts = self._keyframe_prompts(dino_path, dino, imgs_np, keyframes, prompt, box_threshold, text_threshold, max_objects, device, dtype)
         except Exception as e:
-            print(f"⚠️ SAM2Loader DINO Inference Error: {e}")
+            print(f"⚠️ SAM2VideoLoader DINO Inference Error: {e}")
             import traceback
             traceback.print_exc()
-            return ([torch.tensor([0, 0, w, h], dtype=torch.int64)], torch.zeros((1, h, w), dtype=torch.float32))
-        
-        print(f"DEBUG: Found {len(scores)} total objects before filtering.")
-        if len(scores) > 0:
-             print(f"DEBUG: Max score is {scores.max().item():.4f}, threshold is {bt}")
-        
-        # Apply manual threshold filtering using PyTorch indexing
-        # Now we apply our user-provided bounds filtering.
-        valid_indices = scores > bt
-        boxes = boxes[valid_indices]
-        scores = scores[valid_indices]
-        
-        print(f"DEBUG: {len(scores)} objects remained after thresholding.")
-        
-        if len(boxes) == 0:
-            print(f"⚠️ SAM2Loader: GroundingDINO found no objects for prompt '{prompt}' above box_threshold {bt}")
-            # Fallback BBOX is the whole image so the pipeline doesn't violently break
-            return ([torch.tensor([0, 0, w, h], dtype=torch.int64)], torch.zeros((1, h, w), dtype=torch.float32))
-            
-        # Get highest confidence box
-        best_box_idx = scores.argmax()
-        best_box = boxes[best_box_idx] # [xmin, ymin, xmax, ymax]
-        
-        x1, y1, x2, y2 = [int(v.item()) for v in best_box]
-        
-        # Clamp bounds
-        x1, y1 = max(0, x1), max(0, y1)
-        x2, y2 = min(w, x2), min(h, y2)
-        
-        bbox_tensor = torch.tensor([x1, y1, x2, y2], dtype=torch.int64)
-        print(f"✅ SAM2Loader DINO BBox for '{prompt}': {bbox_tensor.tolist()}")
+            return fallback
 
-        # 3. Load SAM2 Model
-        sam_path = folder_paths.get_full_path("sams", sam2_model_name)
-        if hasattr(folder_paths, "get_folder_paths"):
-            if sam_path is None:
-               sam_paths = folder_paths.get_folder_paths("sam")
-               if sam_paths:
-                   for fp in sam_paths:
-                       test_path = os.path.join(fp, sam2_model_name)
-                       if os.path.exists(test_path):
-                           sam_path = test_path
-                           break
-        
+        if not prompts:
+            print(f"⚠️ SAM2VideoLoader: GroundingDINO found no objects for prompt '{prompt}' on any keyframe.")
+            return fallback
+        print(f"✅ SAM2VideoLoader: {len(prompts)} box prompt(s) on {len({f for f, _, _ in prompts})}/{len(keyframes)} keyframe(s).")
+
+        # 2. SAM2 video predictor: prompt keyframes, then propagate through the sequence
+        sam_path, sam2_model_name = _resolve_sam_path(sam2_model_name)
         if sam_path is None:
-             base_path = folder_paths.models_dir
-             sam_dir_resolved = get_model_dir("sam")
-             sams_dir_resolved = get_model_dir("sams")
-             test_path = os.path.join(sam_dir_resolved, "model.safetensors")
-             if os.path.exists(test_path):
-                 sam_path = test_path
-                 sam2_model_name = "model.safetensors"
-             else:
-                 test_path = os.path.join(sams_dir_resolved, sam2_model_name)
-                 if os.path.exists(test_path):
-                     sam_path = test_path
-
-        if not sam_path or not os.path.exists(sam_path):
-            print(f"⚠️ SAM2Loader: Could not find model {sam2_model_name}")
-            return ([bbox_tensor], torch.zeros((1, h, w), dtype=torch.float32))
-            
-        if sam_path in _sam2_cache:
-             predictor = _sam2_cache[sam_path]
-             print(f"⚡ SAM2Loader: Using cached SAM2 from {sam_path}")
-        else:
-             print(f"🔄 SAM2Loader: Loading SAM2 from {sam_path}")
-             if "large" in sam2_model_name:
-                 model_cfg = "sam2_hiera_l.yaml"
-             elif "base_plus" in sam2_model_name:
-                 model_cfg = "sam2_hiera_b+.yaml"
-             elif "small" in sam2_model_name:
-                 model_cfg = "sam2_hiera_s.yaml"
-             elif "tiny" in sam2_model_name:
-                 model_cfg = "sam2_hiera_t.yaml"
-             else:
-                 model_cfg = "sam2_hiera_l.yaml"
-     
-             try:
-                 # PyTorch 2.6+ defaults to weights_only=True which breaks SAM2 safetensors unpickling
-                 # Also, SAM2 repository hardcodes torch.load() which doesn't support .safetensors out of the box.
-                 original_load = torch.load
-                 def safe_load(f, *args, **kwargs):
-                     if isinstance(f, str) and f.endswith(".safetensors"):
-                         import comfy.utils
-                         sd = comfy.utils.load_torch_file(f)
-                         # If it's a flat state dict, wrap it for SAM2's unpickler
-                         if "model" not in sd:
-                             return {"model": sd}
-                         return sd
-                     # Fallback to normal torch load for .pt files but disable weights_only to prevent Unpickler errors
-                     kwargs['weights_only'] = False
-                     return original_load(f, *args, **kwargs)
-                 
-                 torch.load = safe_load
-                 sam2_model = build_sam2(model_cfg, sam_path, device=device)
-                 torch.load = original_load
-                 
-                 predictor = SAM2ImagePredictor(sam2_model)
-                 _sam2_cache[sam_path] = predictor
-             except Exception as e:
-                 # Restore in case of failure
-                 if 'original_load' in locals():
-                     torch.load = original_load
-                 print(f"⚠️ SAM2Loader Error building SAM2: {e}")
-                 import traceback
-                 traceback.print_exc()
-                 return ([bbox_tensor], torch.zeros((1, h, w), dtype=torch.float32))
-
-        # 4. Predict SAM2 Mask using DINO BBox
-        predictor.set_image(img_np)
-        
-        input_box = np.array([x1, y1, x2, y2])
-        
-        try:
-            masks, scores, logits = predictor.predict(
-                box=input_box,
-                multimask_output=False,
-            )
-            
-            # The mask returned by SAM2 is typically [num_masks, H, W] and boolean or float logits.
-            # We take the best mask, convert to float 0.0/1.0, and reshape to [1, H, W]
-            best_mask = masks[0] 
-            
-            print(f"DEBUG: SAM2 Mask shape: {best_mask.shape}, dtype: {best_mask.dtype}, min: {np.min(best_mask)}, max: {np.max(best_mask)}")
-            
-            # If it's already a float logit, we might need a threshold > 0.0
-            # If it's boolean, we convert it.
-            if best_mask.dtype == np.bool_:
-                 mask_np_float = best_mask.astype(np.float32)
-            else:
-                 mask_np_float = (best_mask > 0.0).astype(np.float32)
-                 
-            out_mask = torch.from_numpy(mask_np_float).unsqueeze(0)
-            
-            print(f"DEBUG: Processed Mask shape: {out_mask.shape}, min: {out_mask.min()}, max: {out_mask.max()}")
+            print(f"⚠️ SAM2VideoLoader: Could not find model {sam2_model_name}")
+            return fallback
+        predictor = _load_sam2_video(sam_path, sam2_model_name, device)
+        if predictor is None:
+            return fallback
 
+        try:
+            out_mask = self._propagate(predictor, imgs_np, prompts, device, dtype, offload_frames_to_cpu)
         except Exception as e:
-            print(f"⚠️ SAM2Loader Prediction Error: {e}")
-            out_mask = torch.zeros((1, h, w), dtype=torch.float32)
-            
-        print(f"✅ SAM2Loader: Generated SAM2 mask from DINO BBox successfully.")
-        return ([bbox_tensor], out_mask)
+            print(f"⚠️ SAM2VideoLoader Propagation Error: {e}")
+            import traceback
+            traceback.print_exc()
+            return fallback
+
+        bbox_list = fallback[0]
+        for i in range(b):
+            ys, xs = torch.nonzero(out_mask[i] > 0.5, as_tuple=True)
+            if len(ys):
+                bbox_list[i] = torch.tensor([xs.min().item(), ys.min().item(), xs.max().item() + 1, ys.max().item() + 1], dtype=torch.int64)
+        print(f"✅ SAM2VideoLoader: Propagated masks through {b} frame(s).")
+        return (bbox_list, out_mask)
 
+    def _keyframe_prompts(self, dino_path, dino, imgs_np, keyframes, prompt, box_threshold, text_threshold, max_objects, device, dtype):
+        """Returns ``[(frame_idx, obj_id, [x1, y1, x2, y2])]`` box prompts for the video predictor."""
+        processor, dino_model = dino
+        h, w = imgs_np.shape[1:3]
+
+        detections = []
+        for start in range(0, len(keyframes), self.DINO_CHUNK):
+            chunk = keyframes[start:start + self.DINO_CHUNK]
+            detections += _run_dino_cached(dino_path, processor, dino_model, imgs_np[chunk], prompt, box_threshold, text_threshold, device, dtype)
+
+        prompts, last_boxes = [], {}
+        for frame_idx, det in zip(keyframes, detections):
+            boxes = []
+            for j in det["scores"].argsort(descending=True).tolist():
+                x1, y1, x2, y2 = [int(v.item()) for v in det["boxes"][j]]
+                x1, y1, x2, y2 = max(0, x1), max(0, y1), min(w, x2), min(h, y2)
+                if x2 > x1 and y2 > y1:
+                    boxes.append([x1, y1, x2, y2])
+
+            if not last_boxes:
+                # The first keyframe with detections defines the tracked objects
+                for obj_id, box in enumerate(boxes[:max_objects], start=1):
+                    last_boxes[obj_id] = box
+                    prompts.append((frame_idx, obj_id, box))
+                continue
+
+            for obj_id, previous in last_boxes.items():
+                scored = [(_box_iou(previous, box), k) for k, box in enumerate(boxes)]
+                if not scored:
+                    break
+                overlap, k = max(scored)
+                if overlap >= 0.3:
+                    last_boxes[obj_id] = boxes.pop(k)
+                    prompts.append((frame_idx, obj_id, last_boxes[obj_id]))
+        return prompts
+
+    def _propagate(self, predictor, imgs_np, prompts, device, dtype, offload_frames_to_cpu):
+        import tempfile
+        from PIL import Image
+        b, h, w = imgs_np.shape[:3]
+        out_mask = torch.zeros((b, h, w), dtype=torch.float32)
+
+        # The video predictor loads its frames from a directory of numbered JPEGs
+        with tempfile.TemporaryDirectory(prefix="midnightlook_sam2_") as frame_dir:
+            for i, frame in enumerate(imgs_np):
+                Image.fromarray(frame).save(os.path.join(frame_dir, f"{i:05d}.jpg"), quality=95)
+
+            with torch.inference_mode(), _autocast(device, dtype):
+                state = predictor.init_state(
+                    video_path=frame_dir,
+                    offload_video_to_cpu=offload_frames_to_cpu,
+                    offload_state_to_cpu=offload_frames_to_cpu,
+                )
+                for frame_idx, obj_id, box in prompts:
+                    predictor.add_new_points_or_box(state, frame_idx=frame_idx, obj_id=obj_id, box=np.array(box, dtype=np.float32))
+
+                # Forward from the first prompted frame, then backward to cover frames before it
+                directions = [False] + ([True] if min(f for f, _, _ in prompts) > 0 else [])
+                for reverse in directions:
+                    for frame_idx, _, mask_logits in predictor.propagate_in_video(state, reverse=reverse):
+                        out_mask[frame_idx] = (mask_logits[:, 0] > 0.0).any(dim=0).float().cpu()
+                predictor.reset_state(state)
+
+        return out_mask
+
+
+@functools.lru_cache(maxsize=None)
+def _aspect_buckets(target_size, max_ratio=4.0):
+    """
+    Latent-friendly ``(width, height)`` buckets for a ``target_size`` pixel budget: both sides are
+    multiples of 64, the area is between half of and at most ``target_size ** 2`` and the aspect
+    ratio stays within ``1 / max_ratio .. max_ratio``. Tall buckets mirror the wide ones.
+    """
+    budget = target_size * target_size
+    buckets = set()
+    for side in range(64, int(target_size * math.sqrt(max_ratio)) + 64, 64):
+        other = budget // side // 64 * 64
+        if other >= 64 and 2 * side * other >= budget and max(side, other) <= min(side, other) * max_ratio:
+            buckets.update({(side, other), (other, side)})
+    return tuple(sorted(buckets))
+
+
+def _nearest_bucket(width, height, target_size):
+    """Bucket whose aspect ratio is closest (in log space) to ``width / height``; larger area wins ties."""
+    aspect = math.log(width / height)
+    return min(_aspect_buckets(target_size), key=lambda bucket: (abs(math.log(bucket[0] / bucket[1]) - aspect), -bucket[0] * bucket[1]))
+
+
+class _StageTimer:
+    """Wall-clock timing per pipeline stage; synchronizes CUDA so queued kernels are attributed correctly."""
+
+    def __init__(self, enabled, device):
+        self.enabled = enabled
+        self.device = torch.device(device)
+        self.totals = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        import time
+        self._sync()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._sync()
+            self.totals[name] = self.totals.get(name, 0.0) + time.perf_counter() - start
+
+    def _sync(self):
+        if self.device.type == "cuda":
+            torch.cuda.synchronize(self.device)
+
+    def summary(self):
+        total = sum(self.totals.values())
+        lines = [f"{name}: {seconds * 1000:.1f} ms" for name, seconds in self.totals.items()]
+        return "stage timings (" + f"{total * 1000:.1f} ms total):\n  " + "\n  ".join(lines)
+
+
+def _work_device(vae, image):
+    """The VAE's compute device, falling back to the image's device."""
+    try:
+        return torch.device(getattr(vae, "device", image.device))
+    except (TypeError, RuntimeError):
+        return image.device
+
+
+def _auto_target_size(native_size, target_size, min_upscale, max_upscale):
+    """Working size for a ``native_size`` crop: aim for ``target_size`` within the upscale limits, snapped to 64."""
+    scale = min(max(target_size / native_size, min_upscale), max_upscale)
+    return min(4096, max(64, int(round(native_size * scale / 64.0)) * 64))
 
 
 class MidnightDetailerNode:
     """
     Performs Crop and Stitch detailing on a region defined by a BBOX and MASK.
     Includes mask refinement (dilation/blur), cropping, inpainting via KSampler, and blending back.
+    In "all_regions" mode every BBOX entry is detailed. Every image of the IMAGE batch is processed,
+    and crops sharing a working resolution are sampled together as one latent batch.
+
+    crop_shape "square" crops a square window sampled at target_size x target_size. "aspect_bucket"
+    snaps the window to the nearest latent-friendly aspect bucket (multiples of 64, at most
+    target_size^2 pixels), so elongated regions don't sample irrelevant surroundings.
+
+    resolution_policy "auto" picks the working size from the crop's native size: the upscale towards
+    target_size is clamped to min_upscale..max_upscale, so regions that are already larger than
+    target_size are not resampled down and tiny ones are not blown up without limit.
+    Regions are skipped (left untouched) when their mask coverage is below min_mask_coverage, the
+    mask is empty, or the longer box side is below min_region_size. The report output lists the
+    decision for every region.
+
+    sample_cache keeps the decoded crops of each sampling bucket, keyed by the crop pixels, the
+    sampling mask, model, VAE, prompts and sampler settings. The crop window and noise mask are
+    then derived independently of mask_blur / mask_expand (proportional margin, raw mask), so
+    tweaking only those re-runs the cheap stitch instead of VAE encode / KSampler / decode.
+
+    Crop, resize, mask refinement, noise-mask construction, downscale and blending all run as torch
+    ops on the VAE's device; the result is copied back to a CPU IMAGE once at the end.
+    profile_stages appends a per-stage timing breakdown to the report.
+
+    tiling "auto" details regions whose crop doesn't fit one target_size tile at native resolution
+    (min_upscale under the auto policy) as overlapping tiles instead of downsampling them. Tiles are
+    sampled tile_batch_size at a time, so peak memory doesn't grow with the region, and are
+    cross-faded over tile_overlap working pixels on top of the usual mask blending.
     """
     @classmethod
     def INPUT_TYPES(cls):
@@ -370,97 +940,392 @@ class MidnightDetailerNode:
             },
             "optional": {
                 "bbox": ("BBOX",),
+                "region_mode": (["single", "all_regions"], {"default": "single"}),
+                "crop_shape": (["square", "aspect_bucket"], {"default": "square"}),
+                "resolution_policy": (["fixed", "auto"], {"default": "fixed"}),
+                "min_upscale": ("FLOAT", {"default": 1.0, "min": 0.1, "max": 8.0, "step": 0.05}),
+                "max_upscale": ("FLOAT", {"default": 4.0, "min": 0.1, "max": 8.0, "step": 0.05}),
+                "min_mask_coverage": ("FLOAT", {"default": 0.0, "min": 0.0, "max": 1.0, "step": 0.01, "tooltip": "Skip regions whose mask covers less than this fraction of the crop"}),
+                "min_region_size": ("INT", {"default": 0, "min": 0, "max": 4096, "tooltip": "Skip regions whose longer box side is smaller than this (pixels)"}),
+                "sample_cache": ("BOOLEAN", {"default": False, "tooltip": "Reuse sampled crops when only blend parameters (mask_blur / mask_expand) change"}),
+                "profile_stages": ("BOOLEAN", {"default": False}),
+                "tiling": (["off", "auto"], {"default": "off"}),
+                "tile_overlap": ("INT", {"default": 64, "min": 0, "max": 512, "step": 8}),
+                "tile_batch_size": ("INT", {"default": 4, "min": 1, "max": 64}),
             }
         }
 
-    RETURN_TYPES = ("IMAGE",)
-    RETURN_NAMES = ("image",)
+    RETURN_TYPES = ("IMAGE", "STRING")
+    RETURN_NAMES = ("image", "report")
     FUNCTION = "process"
     CATEGORY = "MidnightLook/Detailer"
 
-    def process(self, image, mask, model, clip, vae, seed, steps, cfg, sampler_name, scheduler, denoise, target_size, mask_blur, mask_expand, preset_prompt, guide_prompt, bbox=None):
+    def process(self, image, mask, model, clip, vae, seed, steps, cfg, sampler_name, scheduler, denoise, target_size, mask_blur, mask_expand, preset_prompt, guide_prompt, bbox=None, region_mode="single", crop_shape="square",
+                resolution_policy="fixed", min_upscale=1.0, max_upscale=4.0, min_mask_coverage=0.0, min_region_size=0, sample_cache=False,
+                profile_stages=False, tiling="off", tile_overlap=64, tile_batch_size=4):
         b, h, w, c = image.shape
         
         # 1. Provide Fallback for BBOX Parsing
-        if bbox is not None:
-            bbox_data = bbox[0]
-            x1, y1, x2, y2 = bbox_data.tolist()
-        else:
+        if bbox is None or len(bbox) == 0:
             print("⚠️ MidnightDetailer: No valid BBOX provided. Returning original image.")
-            return (image,)
-            
+            return (image, "no bbox: nothing detailed")
+
+        # Everything up to the final copy back runs on the VAE's device
+        device = _work_device(vae, image)
+        timer = _StageTimer(profile_stages, device)
+        with timer.stage("upload"):
+            image_dev = image.to(device)
+            mask_dev = mask.to(device)
+
+        # 2. Mask Refinement + 3. Crop + 4. Resize, restricted to each region's crop window
+        regions, report = [], []
+        for batch_idx, box, mask_idx in self._collect_regions(bbox, mask.shape[0], b, region_mode):
+            label = f"image {batch_idx} box {list(box)}"
+            with timer.stage("crop + mask"):
+                region = self._prepare_region(image_dev[batch_idx], mask_dev[mask_idx], box, target_size, mask_expand, mask_blur, crop_shape,
+                                              resolution_policy, min_upscale, max_upscale, sample_cache, tiling, tile_overlap)
+            if region is None:
+                print(f"⚠️ MidnightDetailer: Invalid BBOX dimensions for image {batch_idx} ({box}). Skipping.")
+                report.append(f"{label}: skipped (invalid box)")
+                continue
+
+            skip_reason = self._skip_reason(region, min_mask_coverage, min_region_size)
+            if skip_reason:
+                report.append(f"{label}: skipped ({skip_reason})")
+                continue
+
+            if "tiles" in region:
+                tiles = region["tiles"]
+                tile_desc = f" of {tiles[0]['win_w']}x{tiles[0]['win_h']} -> {tiles[0]['work_size'][1]}x{tiles[0]['work_size'][0]}" if tiles else ""
+                report.append(f"{label}: tiled {region['win_w']}x{region['win_h']} into {len(tiles)} tile(s){tile_desc} (coverage {region['coverage']:.3f})")
+                for tile in tiles:
+                    tile["batch_index"] = batch_idx
+                    regions.append(tile)
+                continue
+
+            work_h, work_w = region["work_size"]
+            scale = max(work_w, work_h) / max(region["win_w"], region["win_h"])
+            report.append(f"{label}: detail {region['win_w']}x{region['win_h']} -> {work_w}x{work_h} (x{scale:.2f}, coverage {region['coverage']:.3f})")
+            region["batch_index"] = batch_idx
+            regions.append(region)
+
+        report_text = "\n".join(report)
+        print(f"DEBUG: MidnightDetailer policy:\n{report_text}")
+        if not regions:
+            print("⚠️ MidnightDetailer: No valid regions to detail. Returning original image.")
+            return (image, report_text)
+
+        # 5. Evaluate Guide Prompts (shared by every region)
+        with timer.stage("prompts"):
+            final_positive, final_negative = self._encode_prompts(clip, preset_prompt, guide_prompt)
+        sampling_key = None
+        if sample_cache:
+            sampling_key = self._sampling_key(model, clip, vae, seed, steps, cfg, sampler_name, scheduler, denoise, preset_prompt, guide_prompt)
+
+        # 6. Bucket regions by working resolution so each bucket costs a single
+        # VAE encode / KSampler / VAE decode regardless of how many regions it holds.
+        # Tiles are sampled in chunks of tile_batch_size to bound peak memory.
+        buckets = {}
+        for region in regions:
+            buckets.setdefault((region["work_size"], region.get("is_tile", False)), []).append(region)
+
+        for ((work_h, work_w), is_tile), bucket in buckets.items():
+            chunk_size = tile_batch_size if is_tile else len(bucket)
+            for start in range(0, len(bucket), chunk_size):
+                chunk = bucket[start:start + chunk_size]
+                # Noise depends on the position in the latent batch, so the whole chunk is the cache unit
+                chunk_key = None if sampling_key is None else (sampling_key, tuple(region["sample_key"] for region in chunk))
+                decoded_img_bhwc = None if chunk_key is None else _sample_cache.get(chunk_key)
+                if decoded_img_bhwc is None:
+                    print(f"DEBUG: MidnightDetailer sampling {len(chunk)} {'tile' if is_tile else 'region'}(s) at {work_w}x{work_h}")
+                    with timer.stage("encode + sample + decode"):
+                        decoded_img_bhwc = self._sample_bucket(chunk, model, vae, final_positive, final_negative, seed, steps, cfg, sampler_name, scheduler, denoise)
+                    if chunk_key is not None:
+                        _sample_cache.put(chunk_key, decoded_img_bhwc)
+                else:
+                    print(f"⚡ MidnightDetailer: Reusing cached samples for {len(chunk)} region(s) at {work_w}x{work_h}")
+                for region, decoded in zip(chunk, decoded_img_bhwc):
+                    region["decoded"] = decoded.unsqueeze(0)
+
+        if sampling_key is not None:
+            print(f"⚡ MidnightDetailer: {_sample_cache.stats_line()}")
+
+        # 7. Downscale and Stitch every region in place into a single output buffer
+        with timer.stage("downscale + blend"):
+            final_image = image_dev.detach().float().clone()
+            for region in regions:
+                self._stitch_region(final_image[region["batch_index"]], region)
+
+        # The single transfer back to ComfyUI's CPU IMAGE
+        with timer.stage("download"):
+            final_image = final_image.cpu()
+
+        if profile_stages:
+            report_text += "\n" + timer.summary()
+            print(f"⏱️ MidnightDetailer {timer.summary()}")
+        
+        print(f"✅ MidnightDetailer: Crop and Stitch complete for {len(regions)} region(s) over {b} image(s) in {len(buckets)} bucket(s) with Denoise {denoise}.")
+        return (final_image, report_text)
+
+    @staticmethod
+    def _collect_regions(bbox, mask_count, batch_size, region_mode):
+        """
+        Maps a BBOX list onto the IMAGE batch and returns ``(batch_index, box, mask_index)`` tuples.
+
+        * Each BBOX entry is a ``[4]`` tensor or a ``[K, 4]`` tensor (several regions).
+        * If the BBOX list has one entry per image, entry ``i`` belongs to image ``i``;
+          otherwise every entry is applied to every image.
+        * "single" mode keeps only the first box of each image (legacy behaviour).
+        * ``mask[j]`` is used for the j-th box when the MASK batch holds one mask per box,
+          ``mask[i]`` for image ``i`` when it holds one mask per image, else ``mask[0]``.
+        """
+        entries = [entry.reshape(-1, 4).tolist() for entry in bbox]
+        per_image = batch_size > 1 and len(entries) == batch_size
+
+        flat = []
+        for batch_idx in range(batch_size):
+            owned = [entries[batch_idx]] if per_image else entries
+            for boxes in owned:
+                for box in boxes:
+                    flat.append((batch_idx, box))
+
+        collected = []
+        seen_images = set()
+        for box_idx, (batch_idx, box) in enumerate(flat):
+            if region_mode != "all_regions":
+                if batch_idx in seen_images:
+                    continue
+                seen_images.add(batch_idx)
+
+            if mask_count == len(flat):
+                mask_idx = box_idx
+            elif mask_count == batch_size:
+                mask_idx = batch_idx
+            else:
+                mask_idx = 0
+            collected.append((batch_idx, box, mask_idx))
+
+        return collected
+
+    @staticmethod
+    def _sampling_key(model, clip, vae, seed, steps, cfg, sampler_name, scheduler, denoise, preset_prompt, guide_prompt):
+        """Key part for everything except the crops that determines the sampled result, or None if uncacheable."""
+        clip_key = _clip_identity(clip)
+        try:
+            model_key = (weakref.ref(model), getattr(model, "patches_uuid", None))
+            vae_ref = weakref.ref(vae)
+        except TypeError:
+            return None
+        if clip_key is None:
+            return None
+        return (model_key, vae_ref, clip_key, preset_prompt, guide_prompt, seed, steps, cfg, sampler_name, scheduler, denoise)
+
+    @staticmethod
+    def _skip_reason(region, min_mask_coverage, min_region_size):
+        """Returns why a prepared region should not be sampled, or None to detail it."""
+        if max(region["box_size"]) < min_region_size:
+            return f"region {region['box_size'][0]}x{region['box_size'][1]} below min_region_size {min_region_size}"
+        if region["coverage"] <= 0.0:
+            return "empty mask"
+        if region["coverage"] < min_mask_coverage:
+            return f"mask coverage {region['coverage']:.3f} below {min_mask_coverage}"
+        return None
+
+    @staticmethod
+    def _window_size(crop_w, crop_h, margin, target_size, crop_shape, resolution_policy="fixed", min_upscale=1.0, max_upscale=4.0):
+        """Returns ``(window_w, window_h, work_w, work_h)`` for a ``crop_w x crop_h`` region."""
+        if crop_shape != "aspect_bucket":
+            win_w = win_h = max(crop_w, crop_h) + int(margin * 2)
+        else:
+            win_w, win_h = crop_w + margin * 2, crop_h + margin * 2
+
+        if resolution_policy == "auto":
+            target_size = _auto_target_size(math.sqrt(win_w * win_h), target_size, min_upscale, max_upscale)
+
+        if crop_shape != "aspect_bucket":
+            return win_w, win_h, target_size, target_size
+
+        work_w, work_h = _nearest_bucket(win_w, win_h, target_size)
+        # Grow the window along one axis so it has exactly the bucket's aspect ratio
+        if win_w * work_h < win_h * work_w:
+            win_w = int(round(win_h * work_w / work_h))
+        else:
+            win_h = int(round(win_w * work_h / work_w))
+        return win_w, win_h, work_w, work_h
+
+    @staticmethod
+    def _prepare_region(image_hwc, mask_hw, box, target_size, mask_expand, mask_blur, crop_shape="square",
+                        resolution_policy="fixed", min_upscale=1.0, max_upscale=4.0, sample_cache=False,
+                        tiling="off", tile_overlap=64):
+        """
+        Crops a window around ``box`` (square, or snapped to an aspect bucket) and resizes it to the
+        working resolution.
+        Mask refinement and reflect padding only touch the crop window (plus a halo for the
+        refinement kernels), never the full frame.
+        Returns a region dict consumed by ``_sample_bucket`` / ``_stitch_region``, or None
+        if the box is empty after clamping. With tiling "auto", windows that don't fit a single
+        target_size tile get a "tiles" list of such dicts instead of their own pixels.
+        """
+        h, w, _ = image_hwc.shape
+        x1, y1, x2, y2 = box
+
         # Validate coordinates
         x1, y1 = max(0, x1), max(0, y1)
         x2, y2 = min(w, x2), min(h, y2)
         crop_w, crop_h = x2 - x1, y2 - y1
         
         if crop_w <= 0 or crop_h <= 0:
-            print("⚠️ MidnightDetailer: Invalid BBOX dimensions. Returning original image.")
-            return (image,)
-            
-        # 2. Mask Refinement (Dilation/Erosion + Blur)
-        # Convert mask to numpy for scipy operations
-        mask_np = mask[0].cpu().numpy()
-        
-        # Dilate or Erode mask
-        if mask_expand > 0:
-            processed_mask = scipy.ndimage.grey_dilation(mask_np, size=(mask_expand, mask_expand))
-        elif mask_expand < 0:
-            processed_mask = scipy.ndimage.grey_erosion(mask_np, size=(-mask_expand, -mask_expand))
-        else:
-            processed_mask = mask_np
-            
-        # Gaussian blur for alpha blending feathering
-        blurred_mask = scipy.ndimage.gaussian_filter(processed_mask, sigma=mask_blur)
-        blurred_mask_tensor = torch.from_numpy(blurred_mask).float().unsqueeze(0) # [1, H, W]
-        
-        # 3. Crop Image & Mask
+            return None
+
         # Add margin to crop box so expanded masks aren't cut off by the original tight bbox
         margin = max(0, mask_expand) + (mask_blur * 2) + 16
+        if sample_cache:
+            # Proportional margin keeps the window (and so the cached sample) stable across blend tweaks
+            margin = max(margin, int(0.25 * max(crop_w, crop_h)) + 16)
         
-        # Square crop logic
+        # Tiles are sampled at native resolution (or min_upscale under the auto policy)
+        tile_scale = min_upscale if resolution_policy == "auto" else 1.0
+        tile_size = int(round(target_size / tile_scale))
+        tiled = tiling == "auto" and max(crop_w, crop_h) + margin * 2 > tile_size
+
+        # Crop window centred on the box
+        if tiled:
+            win_w, win_h = crop_w + margin * 2, crop_h + margin * 2
+        else:
+            win_w, win_h, work_w, work_h = MidnightDetailerNode._window_size(
+                crop_w, crop_h, margin, target_size, crop_shape, resolution_policy, min_upscale, max_upscale)
         center_x, center_y = x1 + crop_w / 2.0, y1 + crop_h / 2.0
-        side_len = max(crop_w, crop_h) + int(margin * 2)
-        sq_x1, sq_y1 = int(center_x - side_len / 2.0), int(center_y - side_len / 2.0)
-        sq_x2, sq_y2 = sq_x1 + side_len, sq_y1 + side_len
-        
-        # Pad if out of bounds
-        img_np = image[0].cpu().numpy()
-        padded_img = np.pad(img_np, ((max(0, -sq_y1), max(0, sq_y2 - h)), (max(0, -sq_x1), max(0, sq_x2 - w)), (0, 0)), mode='reflect')
-        padded_mask = np.pad(blurred_mask, ((max(0, -sq_y1), max(0, sq_y2 - h)), (max(0, -sq_x1), max(0, sq_x2 - w))), mode='constant', constant_values=0)
-        
-        # Adjust indices for padded arrays
-        p_y1, p_x1 = max(0, sq_y1), max(0, sq_x1)
-        p_y2, p_x2 = p_y1 + side_len, p_x1 + side_len
-        
-        cropped_img = padded_img[p_y1:p_y2, p_x1:p_x2, :]
-        cropped_mask = padded_mask[p_y1:p_y2, p_x1:p_x2]
-        
-        # 4. Resize to target resolutions (Upscale)
-        img_for_resize = torch.from_numpy(cropped_img).unsqueeze(0).permute(0, 3, 1, 2) # [1, C, H, W]
-        mask_for_resize = torch.from_numpy(cropped_mask).unsqueeze(0).unsqueeze(0)      # [1, 1, H, W]
-        
-        resized_img_chw = torch.nn.functional.interpolate(img_for_resize, size=(target_size, target_size), mode='bicubic', align_corners=False)
-        resized_mask_chw = torch.nn.functional.interpolate(mask_for_resize, size=(target_size, target_size), mode='bilinear', align_corners=False)
+        sq_x1, sq_y1 = int(center_x - win_w / 2.0), int(center_y - win_h / 2.0)
+        sq_x2, sq_y2 = sq_x1 + win_w, sq_y1 + win_h
+
+        # Part of the window that lies inside the frame
+        in_x1, in_y1 = max(0, sq_x1), max(0, sq_y1)
+        in_x2, in_y2 = min(w, sq_x2), min(h, sq_y2)
+
+        # Mask Refinement (Dilation/Erosion + Blur) on the window plus a halo as wide as the kernels,
+        # which gives the same values inside the window as refining the whole frame
+        halo = abs(mask_expand) + int(4.0 * mask_blur + 0.5) + 1
+        hx1, hy1 = max(0, in_x1 - halo), max(0, in_y1 - halo)
+        hx2, hy2 = min(w, in_x2 + halo), min(h, in_y2 + halo)
+        refined = refine_mask(mask_hw[hy1:hy2, hx1:hx2], mask_expand, mask_blur).to(image_hwc.device)
+
+        # Out-of-frame parts of the window get a zero alpha (constant padding)
+        cropped_mask = torch.zeros((win_h, win_w), dtype=torch.float32, device=image_hwc.device)
+        cropped_mask[in_y1 - sq_y1:in_y2 - sq_y1, in_x1 - sq_x1:in_x2 - sq_x1] = refined[in_y1 - hy1:in_y2 - hy1, in_x1 - hx1:in_x2 - hx1]
+
+        # Reflect-pad only the rows/columns of the window that leave the frame
+        if in_x1 == sq_x1 and in_y1 == sq_y1 and in_x2 == sq_x2 and in_y2 == sq_y2:
+            cropped_img = image_hwc[sq_y1:sq_y2, sq_x1:sq_x2, :]
+        else:
+            rows = _reflect_indices(sq_y1, sq_y2, h, image_hwc.device)
+            cols = _reflect_indices(sq_x1, sq_x2, w, image_hwc.device)
+            cropped_img = image_hwc.index_select(0, rows).index_select(1, cols)
         
-        resized_img_bhwc = resized_img_chw.permute(0, 2, 3, 1) # [1, H, W, C]
+        raw_mask = None
+        if sample_cache:
+            # Sample the raw mask instead of the refined one, so the noise mask doesn't depend on
+            # mask_blur / mask_expand
+            raw_mask = torch.zeros((win_h, win_w), dtype=torch.float32, device=image_hwc.device)
+            raw_mask[in_y1 - sq_y1:in_y2 - sq_y1, in_x1 - sq_x1:in_x2 - sq_x1] = mask_hw[in_y1:in_y2, in_x1:in_x2].float().to(image_hwc.device)
+
+        region = {
+            "x1": sq_x1,
+            "y1": sq_y1,
+            "win_w": win_w,
+            "win_h": win_h,
+            "box_size": (crop_w, crop_h),
+            "coverage": float(cropped_mask.mean().item()),
+            "alpha": cropped_mask,
+        }
+        if tiled:
+            region["tiles"] = MidnightDetailerNode._split_tiles(
+                cropped_img, cropped_mask, raw_mask, sq_x1, sq_y1, tile_size, int(round(tile_overlap / tile_scale)), tile_scale)
+            return region
+
+        region.update(MidnightDetailerNode._resize_to_work(cropped_img, cropped_mask, raw_mask, work_w, work_h))
+        return region
+
+    @staticmethod
+    def _resize_to_work(cropped_img, cropped_mask, raw_mask, work_w, work_h):
+        """Resizes a crop to the working resolution and builds its latent noise mask (and cache key if ``raw_mask`` is given)."""
+        # Resize to target resolutions (Upscale)
+        img_for_resize = cropped_img.unsqueeze(0).permute(0, 3, 1, 2).float() # [1, C, H, W]
+        mask_for_resize = cropped_mask.unsqueeze(0).unsqueeze(0)               # [1, 1, H, W]
         
-        # 5. VAE Encode
-        # vae.encode returns a latent tensor, which usually must be wrapped in dict
-        latent_tensor = vae.encode(resized_img_bhwc[:,:,:,:3])
-        latent = {"samples": latent_tensor}
+        resized_img_chw = torch.nn.functional.interpolate(img_for_resize, size=(work_h, work_w), mode='bicubic', align_corners=False)
+        resized_mask_chw = torch.nn.functional.interpolate(mask_for_resize, size=(work_h, work_w), mode='bilinear', align_corners=False)
         
-        # 6. Set Noise Mask on Latent
         # KSampler expects noise_mask to match latent spatial dimensions [B, H, W]
-        latent_mask = torch.nn.functional.interpolate(resized_mask_chw, size=(target_size // 8, target_size // 8), mode='nearest').squeeze(1)
-        latent["noise_mask"] = latent_mask
-        
-        # 6.5 Evaluate Guide Prompts
-        # Create empty conditionings first
-        from nodes import CLIPTextEncode
-        
+        latent_mask = torch.nn.functional.interpolate(resized_mask_chw, size=(work_h // 8, work_w // 8), mode='nearest').squeeze(1)
+        if raw_mask is not None:
+            # Every latent cell the raw mask touches, grown by one cell
+            latent_mask = torch.nn.functional.adaptive_max_pool2d(raw_mask[None, None], (work_h // 8, work_w // 8))
+            latent_mask = torch.nn.functional.max_pool2d(latent_mask, kernel_size=3, stride=1, padding=1).squeeze(1)
+
+        return {
+            "work_size": (work_h, work_w),
+            "sample_key": (work_h, work_w, image_hash(resized_img_chw), image_hash(latent_mask)) if raw_mask is not None else None,
+            "pixels": resized_img_chw.permute(0, 2, 3, 1), # [1, H, W, C]
+            "noise_mask": latent_mask,
+        }
+
+    @staticmethod
+    def _tile_starts(length, tile, overlap):
+        """Evenly spread tile offsets covering ``length`` with at least ``overlap`` pixels shared; returns ``(starts, tile)``."""
+        if tile >= length:
+            return [0], length
+        overlap = min(overlap, tile // 2)
+        count = math.ceil((length - overlap) / (tile - overlap))
+        return [int(round(k * (length - tile) / (count - 1))) for k in range(count)], tile
+
+    @staticmethod
+    def _split_tiles(cropped_img, cropped_mask, raw_mask, x0, y0, tile_size, overlap, scale):
+        """
+        Splits a native-resolution window into overlapping tiles sampled at ``tile_size * scale``.
+        Tiles are stitched in raster order; each tile's alpha fades in linearly over its overlap with
+        the tiles stitched before it (left / top), so neighbours cross-fade instead of showing seams.
+        Tiles without any mask are dropped.
+        """
+        win_h, win_w = cropped_mask.shape
+        ys, tile_h = MidnightDetailerNode._tile_starts(win_h, tile_size, overlap)
+        xs, tile_w = MidnightDetailerNode._tile_starts(win_w, tile_size, overlap)
+        work_w = max(64, int(round(tile_w * scale / 64.0)) * 64)
+        work_h = max(64, int(round(tile_h * scale / 64.0)) * 64)
+        device = cropped_mask.device
+
+        tiles = []
+        for i, ty in enumerate(ys):
+            for j, tx in enumerate(xs):
+                alpha = cropped_mask[ty:ty + tile_h, tx:tx + tile_w]
+                if not bool((alpha > 0).any()):
+                    continue
+
+                ramp = torch.ones((tile_h, tile_w), dtype=torch.float32, device=device)
+                if j > 0:
+                    shared = xs[j - 1] + tile_w - tx
+                    ramp *= ((torch.arange(tile_w, device=device) + 0.5) / shared).clamp(max=1.0)[None, :]
+                if i > 0:
+                    shared = ys[i - 1] + tile_h - ty
+                    ramp *= ((torch.arange(tile_h, device=device) + 0.5) / shared).clamp(max=1.0)[:, None]
+
+                tile = {
+                    "x1": x0 + tx,
+                    "y1": y0 + ty,
+                    "win_w": tile_w,
+                    "win_h": tile_h,
+                    "alpha": alpha * ramp,
+                    "is_tile": True,
+                }
+                tile_raw = None if raw_mask is None else raw_mask[ty:ty + tile_h, tx:tx + tile_w]
+                tile.update(MidnightDetailerNode._resize_to_work(
+                    cropped_img[ty:ty + tile_h, tx:tx + tile_w], alpha, tile_raw, work_w, work_h))
+                tiles.append(tile)
+        return tiles
+
+    @staticmethod
+    def _encode_prompts(clip, preset_prompt, guide_prompt):
         # Default empty conditionings
-        empty_cond = CLIPTextEncode().encode(clip, "")[0]
+        empty_cond = _encode_text_cached(clip, "")
         final_positive = empty_cond
         final_negative = empty_cond
         
@@ -473,41 +1338,57 @@ class MidnightDetailerNode:
         if custom_parts:
             combined_text = ", ".join(custom_parts)
             print(f"DEBUG: Encoding Detailer Custom Prompt: '{combined_text}'")
-            final_positive = CLIPTextEncode().encode(clip, combined_text)[0]
+            final_positive = _encode_text_cached(clip, combined_text)
+
+        print(f"⚡ MidnightDetailer: {_cond_cache.stats_line()}")
+        return final_positive, final_negative
+
+    @staticmethod
+    def _sample_bucket(bucket, model, vae, positive, negative, seed, steps, cfg, sampler_name, scheduler, denoise):
+        """Runs one VAE encode / KSampler / VAE decode over all regions of a bucket."""
+        pixels = torch.cat([region["pixels"] for region in bucket], dim=0)
+
+        # vae.encode returns a latent tensor, which usually must be wrapped in dict
+        latent = {
+            "samples": vae.encode(pixels[:, :, :, :3]),
+            "noise_mask": torch.cat([region["noise_mask"] for region in bucket], dim=0),
+        }
         
-        # 7. KSampler Inpaint
         # common_ksampler(model, seed, steps, cfg, sampler_name, scheduler, positive, negative, latent, denoise)
-        sampled_latent = nodes.common_ksampler(model, seed, steps, cfg, sampler_name, scheduler, final_positive, final_negative, latent, denoise=denoise)[0]
+        sampled_latent = nodes.common_ksampler(model, seed, steps, cfg, sampler_name, scheduler, positive, negative, latent, denoise=denoise)[0]
         
-        # 8. VAE Decode
-        decoded_img_bhwc = vae.decode(sampled_latent["samples"]) # [1, H, W, 3]
-        decoded_img_chw = decoded_img_bhwc.permute(0, 3, 1, 2)
-        
-        # 9. Downscale and Stitch
-        downscaled_img_chw = torch.nn.functional.interpolate(decoded_img_chw, size=(side_len, side_len), mode='area')
-        downscaled_img_bhwc = downscaled_img_chw.permute(0, 2, 3, 1)
-        
-        # Paste back to padded base, then crop to original bounds
-        result_padded = padded_img.copy()
-        
-        # Alpha blending on the padded regions
-        alpha_mask = padded_mask[p_y1:p_y2, p_x1:p_x2, np.newaxis]
-        result_padded[p_y1:p_y2, p_x1:p_x2, :] = (downscaled_img_bhwc[0].cpu().numpy() * alpha_mask) + (result_padded[p_y1:p_y2, p_x1:p_x2, :] * (1 - alpha_mask))
-        
-        # Unpad
-        unpadded_result = result_padded[max(0, -sq_y1):max(0, -sq_y1)+h, max(0, -sq_x1):max(0, -sq_x1)+w, :]
-        
-        final_image = torch.from_numpy(unpadded_result).unsqueeze(0).float()
-        
-        print(f"✅ MidnightDetailer: Crop and Stitch complete with Denoise {denoise}.")
-        return (final_image,)
+        return vae.decode(sampled_latent["samples"]) # [N, H, W, 3]
+
+    @staticmethod
+    def _stitch_region(result, region):
+        """Alpha-blends a decoded region in place into ``result`` (torch [H, W, C])."""
+        h, w, _ = result.shape
+        sq_x1, sq_y1, win_w, win_h = region["x1"], region["y1"], region["win_w"], region["win_h"]
+
+        # Only the part of the crop window that lies inside the frame is written back
+        d_y1, d_x1 = max(0, sq_y1), max(0, sq_x1)
+        d_y2, d_x2 = min(h, sq_y1 + win_h), min(w, sq_x1 + win_w)
+        s_y1, s_x1 = d_y1 - sq_y1, d_x1 - sq_x1
+        s_y2, s_x2 = s_y1 + (d_y2 - d_y1), s_x1 + (d_x2 - d_x1)
+
+        # vae.decode returns on ComfyUI's output device; resample on the blend device
+        decoded_img_chw = region["decoded"].to(result).permute(0, 3, 1, 2)
+        downscaled_img_chw = torch.nn.functional.interpolate(decoded_img_chw, size=(win_h, win_w), mode='area')
+        patch = downscaled_img_chw[0, :3, s_y1:s_y2, s_x1:s_x2].permute(1, 2, 0)
+
+        # dst = patch * alpha + dst * (1 - alpha), written through the view into the output buffer
+        dst = result[d_y1:d_y2, d_x1:d_x2, :3]
+        alpha_mask = region["alpha"][s_y1:s_y2, s_x1:s_x2, None].to(result)
+        dst.add_((patch - dst) * alpha_mask)
 
 NODE_CLASS_MAPPINGS = {
     "SAM2LoaderNode": SAM2LoaderNode,
+    "SAM2VideoLoaderNode": SAM2VideoLoaderNode,
     "MidnightDetailerNode": MidnightDetailerNode,
 }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
     "SAM2LoaderNode": "SAM2 Loader (ML)",
+    "SAM2VideoLoaderNode": "SAM2 Video Loader (ML)",
     "MidnightDetailerNode": "Midnight Detailer (ML)",
 }
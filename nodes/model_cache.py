@@ -0,0 +1,195 @@
+"""
+Managed Auxiliary Model Cache
+=============================
+Keeps auxiliary models (GroundingDINO, SAM2, ...) resident between runs
+without letting them squat on VRAM forever.
+
+* LRU order over all cached models.
+* VRAM budget (``MIDNIGHTLOOK_AUX_VRAM_MB``): when a model is moved onto a GPU,
+  least-recently-used cached models on that GPU are offloaded to the CPU until
+  it fits. ComfyUI is then asked to free the same amount for its own models.
+* RAM budget (``MIDNIGHTLOOK_AUX_RAM_MB``): offloaded models beyond the budget
+  are dropped, least-recently-used first.
+* ComfyUI integration: ``comfy.model_management.free_memory`` and
+  ``unload_all_models`` are wrapped so that memory requests from ComfyUI (model
+  loads under ``--lowvram``, "Clear VRAM" nodes, ...) also offload these models;
+  a short ``free_memory`` offloads them first, before ComfyUI unloads its own.
+
+Budgets of ``0`` disable the corresponding limit.
+
+Dependencies: torch, comfy
+"""
+
+import itertools
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+import torch
+import comfy.model_management
+
+_CPU = torch.device("cpu")
+_CACHES = weakref.WeakSet()
+
+
+def _budget_from_env(name, default_mb):
+    mb = int(os.environ.get(name, default_mb))
+    return mb * 1024 * 1024 if mb > 0 else None
+
+
+def _normalize_device(device):
+    device = torch.device(device)
+    if device.type == "cuda" and device.index is None:
+        return torch.device("cuda", torch.cuda.current_device())
+    return device
+
+
+def _module_size(module):
+    return sum(t.numel() * t.element_size() for t in itertools.chain(module.parameters(), module.buffers()))
+
+
+def _module_device(module):
+    for t in itertools.chain(module.parameters(), module.buffers()):
+        return _normalize_device(t.device)
+    return _CPU
+
+
+class ManagedModelCache:
+    """LRU cache of ``value`` objects whose ``module`` is moved between devices under VRAM/RAM budgets."""
+
+    def __init__(self, name, vram_budget=None, ram_budget=None):
+        self.name = name
+        self.vram_budget = vram_budget
+        self.ram_budget = ram_budget
+        self._entries = OrderedDict()  # key -> {"value", "module", "size", "device"}
+        self._lock = threading.RLock()
+        _CACHES.add(self)
+
+    def get(self, key, device):
+        """Returns the cached value with its module placed on ``device``, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            self._place(key, entry, _normalize_device(device))
+            return entry["value"]
+
+    def put(self, key, value, module, device):
+        """Registers ``value`` (owning ``module``) and places the module on ``device``."""
+        with self._lock:
+            entry = {"value": value, "module": module, "size": _module_size(module), "device": _module_device(module)}
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._place(key, entry, _normalize_device(device))
+            self._enforce_ram_budget()
+            return value
+
+    def offload(self, device=None):
+        """Moves every cached model on ``device`` (all GPUs if None) to the CPU."""
+        moved = 0
+        with self._lock:
+            for entry in self._entries.values():
+                if entry["device"].type == "cpu":
+                    continue
+                if device is not None and entry["device"] != _normalize_device(device):
+                    continue
+                self._offload(entry)
+                moved += 1
+            self._enforce_ram_budget()
+        return moved
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats_line(self):
+        with self._lock:
+            on_gpu = [e for e in self._entries.values() if e["device"].type != "cpu"]
+            return (
+                f"{self.name}: {len(self._entries)} model(s), {len(on_gpu)} on GPU "
+                f"({sum(e['size'] for e in on_gpu) / 1024 ** 2:.0f} MB)"
+            )
+
+    def _bytes_on(self, device, exclude=None):
+        return sum(e["size"] for k, e in self._entries.items() if e["device"] == device and k != exclude)
+
+    def _offload(self, entry):
+        entry["module"].to(_CPU)
+        entry["device"] = _CPU
+
+    def _place(self, key, entry, device):
+        if entry["device"] == device:
+            return
+        if device.type != "cpu":
+            # LRU-offload our own models on this device until the new one fits the VRAM budget...
+            if self.vram_budget is not None:
+                for other_key, other in list(self._entries.items()):
+                    if self._bytes_on(device, exclude=key) + entry["size"] <= self.vram_budget:
+                        break
+                    if other_key != key and other["device"] == device:
+                        self._offload(other)
+            # ...then let ComfyUI make room the same way it does for its own models
+            comfy.model_management.free_memory(entry["size"], device)
+        entry["module"].to(device)
+        entry["device"] = device
+        self._enforce_ram_budget()
+
+    def _enforce_ram_budget(self):
+        if self.ram_budget is None:
+            return
+        for key, entry in list(self._entries.items()):
+            if self._bytes_on(_CPU) <= self.ram_budget:
+                break
+            # The most recently used entry is never dropped
+            if entry["device"].type == "cpu" and key != next(reversed(self._entries)):
+                print(f"🧹 {self.name}: Dropping {key} to stay within the RAM budget.")
+                del self._entries[key]
+
+
+def offload_all(device=None):
+    """Offloads every managed cache's models on ``device`` (all GPUs if None) to the CPU."""
+    moved = sum(cache.offload(device) for cache in list(_CACHES))
+    if moved:
+        print(f"🧹 MidnightLook: Offloaded {moved} auxiliary model(s) to CPU.")
+    return moved
+
+
+def _install_memory_hooks():
+    mm = comfy.model_management
+    if getattr(mm, "_midnightlook_hooks_installed", False):
+        return
+
+    original_free_memory = mm.free_memory
+    original_unload_all_models = mm.unload_all_models
+
+    def free_memory(memory_required, device, *args, **kwargs):
+        # Idle auxiliary weights give way before ComfyUI unloads any of its own models
+        try:
+            if torch.device(device).type != "cpu" and mm.get_free_memory(device) < memory_required:
+                if offload_all(device):
+                    mm.soft_empty_cache()
+        except Exception as e:
+            print(f"⚠️ MidnightLook: Auxiliary model offload failed: {e}")
+        return original_free_memory(memory_required, device, *args, **kwargs)
+
+    def unload_all_models(*args, **kwargs):
+        result = original_unload_all_models(*args, **kwargs)
+        if offload_all():
+            mm.soft_empty_cache()
+        return result
+
+    mm.free_memory = free_memory
+    mm.unload_all_models = unload_all_models
+    mm._midnightlook_hooks_installed = True
+
+
+_install_memory_hooks()
+
+# Shared by every node that loads GroundingDINO / SAM2 style helper models
+aux_models = ManagedModelCache(
+    "MidnightLook aux models",
+    vram_budget=_budget_from_env("MIDNIGHTLOOK_AUX_VRAM_MB", 4096),
+    ram_budget=_budget_from_env("MIDNIGHTLOOK_AUX_RAM_MB", 8192),
+)
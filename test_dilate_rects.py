@@ -0,0 +1,88 @@
+import importlib
+import os
+import sys
+import types
+
+import cv2
+import numpy as np
+
+# Randomized check of DeepFaceBBoxDetector's vectorized rectangle dilation
+# (nodes/deepface_node.py _dilate_rects) against what Impact Pack's dilate_mask
+# does to the drawn mask: cv2.dilate / cv2.erode with a |dilation| x |dilation|
+# ones kernel, default anchor, one iteration. Covers odd and even kernels,
+# erosion that empties the rectangle and rectangles touching the mask border.
+#
+#   python test_dilate_rects.py [--trials 2000] [--seed 0]
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+trials = int(sys.argv[sys.argv.index("--trials") + 1]) if "--trials" in sys.argv else 2000
+seed = int(sys.argv[sys.argv.index("--seed") + 1]) if "--seed" in sys.argv else 0
+
+# Load nodes/ under its own package name; importing it as a package needs ComfyUI
+package = types.ModuleType("midnightlook_nodes")
+package.__path__ = [os.path.join(ROOT, "nodes")]
+sys.modules["midnightlook_nodes"] = package
+deepface_node = importlib.import_module("midnightlook_nodes.deepface_node")
+
+
+def random_rect(rng, w, h):
+    """Rectangle inside a w x h mask; each edge sits on the mask border a third of the time."""
+    x1 = 0 if rng.random() < 1 / 3 else int(rng.integers(0, w))
+    y1 = 0 if rng.random() < 1 / 3 else int(rng.integers(0, h))
+    x2 = w if rng.random() < 1 / 3 else int(rng.integers(x1 + 1, w + 1))
+    y2 = h if rng.random() < 1 / 3 else int(rng.integers(y1 + 1, h + 1))
+    return x1, y1, x2, y2
+
+
+def reference(rect, dilation, w, h):
+    """Impact Pack's dilate_mask on the drawn rectangle."""
+    x1, y1, x2, y2 = rect
+    mask = np.zeros((h, w), dtype=np.uint8)
+    mask[y1:y2, x1:x2] = 1
+    if dilation == 0:
+        return mask
+    kernel = np.ones((abs(dilation), abs(dilation)), np.uint8)
+    return cv2.dilate(mask, kernel) if dilation > 0 else cv2.erode(mask, kernel)
+
+
+def draw(rect, w, h):
+    x1, y1, x2, y2 = (int(v) for v in rect)
+    mask = np.zeros((h, w), dtype=np.uint8)
+    if x2 > x1 and y2 > y1:
+        mask[y1:y2, x1:x2] = 1
+    return mask
+
+
+rng = np.random.default_rng(seed)
+failures = 0
+checked = 0
+for trial in range(trials):
+    dilation = int(rng.integers(-12, 13))
+    # One call per dilation over a batch of rectangles on masks of different sizes
+    sizes = rng.integers(1, 48, size=(int(rng.integers(1, 9)), 2))
+    rects = [random_rect(rng, int(w), int(h)) for w, h in sizes]
+    result = deepface_node._dilate_rects(rects, dilation, sizes[:, 0], sizes[:, 1])
+
+    for rect, out, (w, h) in zip(rects, result, sizes):
+        checked += 1
+        expected = reference(rect, dilation, int(w), int(h))
+        if not np.array_equal(draw(out, int(w), int(h)), expected):
+            failures += 1
+            if failures <= 10:
+                ys, xs = np.nonzero(expected)
+                want = (int(xs.min()), int(ys.min()), int(xs.max()) + 1, int(ys.max()) + 1) if len(xs) else "empty"
+                print(f"FAIL dilation {dilation} on {w}x{h}: {rect} -> {tuple(int(v) for v in out)}, cv2 {want}")
+
+    # Scalar w / h must give the same result as per-rectangle arrays
+    w, h = int(sizes[0, 0]), int(sizes[0, 1])
+    same_size = [random_rect(rng, w, h) for _ in range(4)]
+    if not np.array_equal(
+        deepface_node._dilate_rects(same_size, dilation, w, h),
+        deepface_node._dilate_rects(same_size, dilation, np.full(4, w), np.full(4, h)),
+    ):
+        failures += 1
+        print(f"FAIL scalar vs array size, dilation {dilation} on {w}x{h}")
+
+print(f"_dilate_rects: {checked} rectangle(s), {failures} failure(s)")
+sys.exit(1 if failures else 0)
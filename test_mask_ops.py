@@ -0,0 +1,95 @@
+import importlib
+import itertools
+import os
+import sys
+import types
+
+import torch
+
+# Parity checks for the mask refinement used by MidnightDetailer:
+#   * nodes/mask_ops.py refine_mask_torch against the scipy reference (odd / even /
+#     negative mask_expand, mask_blur 0 and > 0, masks touching the frame edge);
+#   * the crop-window halo of MidnightDetailerNode._prepare_region against refining
+#     the full frame. This part needs ComfyUI, so run it from the ComfyUI directory:
+#
+#   python test_mask_ops.py
+#   cd ComfyUI && python custom_nodes/ComfyUI-MidnightLook/test_mask_ops.py
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+TOLERANCE = 1e-5
+
+# ComfyUI's own `nodes` module must win over this repo's nodes/ package
+sys.path[0] = os.getcwd()
+
+# Load nodes/ under its own package name; importing it as a package needs ComfyUI
+package = types.ModuleType("midnightlook_nodes")
+package.__path__ = [os.path.join(ROOT, "nodes")]
+sys.modules["midnightlook_nodes"] = package
+mask_ops = importlib.import_module("midnightlook_nodes.mask_ops")
+
+EXPANDS = [-6, -5, -2, -1, 0, 1, 2, 3, 4, 7, 8]
+BLURS = [0, 1, 3, 4]
+
+
+def make_masks(h, w, seed):
+    """Batch of masks: soft blobs inside, blobs cut by every edge, a full frame, and noise."""
+    g = torch.Generator().manual_seed(seed)
+    ys, xs = torch.meshgrid(torch.arange(h, dtype=torch.float32), torch.arange(w, dtype=torch.float32), indexing="ij")
+    masks = []
+    for cy, cx in [(h / 2, w / 2), (0, w / 3), (h - 1, w / 2), (h / 3, 0), (h / 2, w - 1), (0, 0), (h - 1, w - 1)]:
+        r = float(torch.randint(3, max(4, min(h, w) // 2), (1,), generator=g))
+        masks.append((((ys - cy) ** 2 + (xs - cx) ** 2) <= r * r).float())
+    masks.append(torch.ones(h, w))
+    masks.append(torch.rand(h, w, generator=g))
+    masks.append((torch.rand(h, w, generator=g) > 0.7).float() * torch.rand(h, w, generator=g))
+    return torch.stack(masks)
+
+
+failures = 0
+worst = 0.0
+print(f"{'size':<10}{'expand':>8}{'blur':>6}{'max |torch - scipy|':>22}")
+for (h, w), expand, blur in itertools.product([(37, 50), (48, 64), (9, 8)], EXPANDS, BLURS):
+    masks = make_masks(h, w, seed=h * 1000 + w)
+    diff = float((mask_ops.refine_mask_torch(masks, expand, blur) - mask_ops.refine_mask_scipy(masks, expand, blur)).abs().max())
+    # 2D input keeps its shape on both paths
+    single = mask_ops.refine_mask_torch(masks[1], expand, blur)
+    diff = max(diff, float((single - mask_ops.refine_mask_scipy(masks[1], expand, blur)).abs().max()))
+    worst = max(worst, diff)
+    if diff > TOLERANCE or single.shape != (h, w):
+        failures += 1
+        print(f"{f'{h}x{w}':<10}{expand:>8}{blur:>6}{diff:>22.2e}  FAIL")
+print(f"mask_ops: {failures} failure(s), worst difference {worst:.2e}")
+
+try:
+    import comfy.utils  # noqa: F401
+except ImportError:
+    print("⚠️ ComfyUI not importable: skipping the _prepare_region halo check (run from the ComfyUI directory).")
+    sys.exit(1 if failures else 0)
+
+MidnightDetailerNode = importlib.import_module("midnightlook_nodes.midnight_detailer").MidnightDetailerNode
+
+halo_failures = 0
+halo_worst = 0.0
+h, w = 96, 128
+masks = make_masks(h, w, seed=7)
+image = torch.rand(h, w, 3, generator=torch.Generator().manual_seed(7))
+boxes = [(40, 30, 80, 60), (0, 0, 30, 20), (100, 70, 128, 96), (0, 40, 20, 70), (60, 0, 128, 30), (0, 0, 128, 96)]
+for expand, blur, box, crop_shape in itertools.product([-5, -2, 0, 3, 8], [0, 1, 4], boxes, ["square", "aspect_bucket"]):
+    for mask in masks:
+        region = MidnightDetailerNode._prepare_region(image, mask, box, 64, expand, blur, crop_shape=crop_shape)
+        full = mask_ops.refine_mask_torch(mask, expand, blur)
+        x1, y1, win_w, win_h = region["x1"], region["y1"], region["win_w"], region["win_h"]
+
+        # Same window cut out of the fully refined frame, zero outside the frame
+        expected = torch.zeros((win_h, win_w))
+        in_x1, in_y1, in_x2, in_y2 = max(0, x1), max(0, y1), min(w, x1 + win_w), min(h, y1 + win_h)
+        expected[in_y1 - y1:in_y2 - y1, in_x1 - x1:in_x2 - x1] = full[in_y1:in_y2, in_x1:in_x2]
+
+        diff = float((region["alpha"].cpu() - expected).abs().max())
+        halo_worst = max(halo_worst, diff)
+        if diff > TOLERANCE:
+            halo_failures += 1
+            print(f"halo: expand {expand} blur {blur} box {box} {crop_shape}: {diff:.2e}  FAIL")
+print(f"_prepare_region halo: {halo_failures} failure(s), worst difference {halo_worst:.2e}")
+
+sys.exit(1 if failures or halo_failures else 0)